@@ -0,0 +1,299 @@
+"""
+Throughput benchmark for the Data Encrypter engine.
+
+Generates synthetic files, then measures key derivation time, encrypt/decrypt
+throughput, peak RSS and CPU utilisation for the original whole-file Fernet
+path and for each engine mode. Every case runs in its own subprocess so peak
+RSS is measured in isolation. Results are written as a JSON report, and a
+previous report can be passed with --compare to flag regressions:
+
+    python benchmark.py --sizes 1K,1M,64M,1G --output report.json
+    python benchmark.py --output new.json --compare report.json --tolerance 10
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cryptography
+from cryptography.fernet import Fernet
+
+import crypto_engine
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not collected
+    resource = None
+
+PASSWORD = b"benchmark password"
+# Throughput runs use a cheap KDF so MB/s reflects the data path only; KDF
+# cost is measured separately.
+THROUGHPUT_KDF = {"name": "pbkdf2-sha256", "iterations": 1000}
+GENERATE_BLOCK = 4 * 1024 * 1024
+# Below this, CPU time is mostly interpreter start-up and timer resolution, so
+# the utilisation of shorter cases is reported as null.
+CPU_MIN_SECONDS = 0.1
+
+# name -> keyword arguments for crypto_engine.process_file, or None for the
+# original whole-file Fernet implementation.
+MODES = {
+    "legacy": None,
+    "fernet": {"workers": 1, "cipher": "fernet"},
+    "stream": {"workers": 1},
+    "parallel": {"workers": os.cpu_count() or 1},
+    # Synthetic data is random, so this measures the cost of sampling and
+    # skipping incompressible chunks.
+    "zlib": {"workers": 1, "compression": {"codec": "zlib"}},
+}
+
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+
+def size_label(size):
+    for unit in ("G", "M", "K"):
+        if size >= _UNITS[unit] and size % _UNITS[unit] == 0:
+            return f"{size // _UNITS[unit]}{unit}"
+    return str(size)
+
+
+def generate_file(path, size):
+    """Writes `size` random bytes to `path`, reusing an existing file of that size."""
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return
+    with open(path, "wb") as file:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(GENERATE_BLOCK, remaining))
+            file.write(block)
+            remaining -= len(block)
+
+
+def _legacy_key():
+    return crypto_engine.derive_key(PASSWORD, b"\0" * crypto_engine.SALT_SIZE, THROUGHPUT_KDF)
+
+
+def _legacy_encrypt(input_path, output_path):
+    """The original MainWindow.encrypt_file_action data path."""
+    salt = os.urandom(crypto_engine.SALT_SIZE)
+    with open(input_path, "rb") as file:
+        original_data = file.read()
+    encrypted_data = Fernet(_legacy_key()).encrypt(original_data)
+    with open(output_path, "wb") as file:
+        file.write(salt + encrypted_data)
+
+
+def _legacy_decrypt(input_path, output_path):
+    """The original MainWindow.decrypt_file_action data path."""
+    with open(input_path, "rb") as file:
+        full_encrypted_data = file.read()
+    decrypted_data = Fernet(_legacy_key()).decrypt(full_encrypted_data[crypto_engine.SALT_SIZE:])
+    with open(output_path, "wb") as file:
+        file.write(decrypted_data)
+
+
+def _peak_rss_bytes():
+    """
+    Peak RSS of this process. On Linux this is VmHWM, which starts afresh at
+    exec; ru_maxrss there carries over the launching process's peak, so a
+    large parent would be counted in every case.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+
+
+def run_case(mode, operation, input_path, output_path):
+    """Runs one case in this process and returns its measurements."""
+    options = MODES[mode]
+    keys = crypto_engine.KeyProvider(PASSWORD, kdf=THROUGHPUT_KDF)
+    keys.master_key(keys.salt, keys.kdf)
+    cpu_before = os.times()
+    started = time.perf_counter()
+    if options is None:
+        (_legacy_encrypt if operation == "encrypt" else _legacy_decrypt)(input_path, output_path)
+    else:
+        crypto_engine.process_file(operation, input_path, output_path, keys, **options)
+    seconds = time.perf_counter() - started
+    cpu_after = os.times()
+    # User + system time of this process and its pool workers (children are
+    # not tracked on Windows).
+    cpu_seconds = sum(after - before for after, before in zip(cpu_after[:4], cpu_before[:4]))
+    if resource is None:
+        return {"seconds": seconds, "cpu_seconds": cpu_seconds, "peak_rss_bytes": 0,
+                "peak_child_rss_bytes": 0}
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "peak_child_rss_bytes": children.ru_maxrss * rss_scale,
+    }
+
+
+def measure_case(mode, operation, input_path, output_path):
+    """Runs one case in a fresh interpreter so its peak RSS is isolated."""
+    command = [sys.executable, os.path.abspath(__file__), "_case", mode, operation,
+               os.path.abspath(input_path), os.path.abspath(output_path)]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(completed.stdout)
+
+
+def measure_kdfs(repeats=3):
+    results = []
+    for name in sorted(crypto_engine.KDFS):
+        kdf = crypto_engine.KDF_DEFAULTS[name]
+        timings = []
+        try:
+            for _ in range(repeats):
+                started = time.perf_counter()
+                crypto_engine.derive_key(PASSWORD, os.urandom(crypto_engine.SALT_SIZE), kdf)
+                timings.append(time.perf_counter() - started)
+        except crypto_engine.EncryptionFormatError as e:
+            results.append({"kdf": kdf, "error": str(e)})
+            continue
+        results.append({"kdf": kdf, "seconds": min(timings)})
+    return results
+
+
+def run_benchmark(sizes, modes, work_dir, legacy_max, log=print):
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for size in sizes:
+        plain_path = os.path.join(work_dir, f"plain-{size_label(size)}.bin")
+        generate_file(plain_path, size)
+        for mode in modes:
+            if MODES[mode] is None and size > legacy_max:
+                log(f"skip  {mode:<10} {size_label(size):>6}  (whole-file path needs ~3x the file in RAM)")
+                continue
+            encrypted_path = os.path.join(work_dir, f"{mode}-{size_label(size)}.encrypted")
+            decrypted_path = os.path.join(work_dir, f"{mode}-{size_label(size)}.decrypted")
+            for operation, source, target in (("encrypt", plain_path, encrypted_path),
+                                              ("decrypt", encrypted_path, decrypted_path)):
+                case = measure_case(mode, operation, source, target)
+                seconds = max(case["seconds"], 1e-9)
+                cpu_utilisation = (case["cpu_seconds"] / seconds
+                                   if case["seconds"] >= CPU_MIN_SECONDS else None)
+                result = {
+                    "mode": mode,
+                    "operation": operation,
+                    "size": size,
+                    "output_size": os.path.getsize(target),
+                    "seconds": case["seconds"],
+                    "mb_per_s": size / seconds / 1024 ** 2,
+                    "cpu_utilisation": cpu_utilisation,
+                    "peak_rss_bytes": case["peak_rss_bytes"],
+                    "peak_child_rss_bytes": case["peak_child_rss_bytes"],
+                }
+                results.append(result)
+                cpu = "     -" if cpu_utilisation is None else f"{cpu_utilisation * 100:5.0f}%"
+                log(f"{operation:<7} {mode:<10} {size_label(size):>6}  {result['mb_per_s']:9.1f} MB/s  "
+                    f"cpu {cpu}  "
+                    f"rss {result['peak_rss_bytes'] / 1024 ** 2:7.1f} MB")
+            for path in (encrypted_path, decrypted_path):
+                os.remove(path)
+    return results
+
+
+def compare_reports(current, baseline, tolerance):
+    """
+    Returns human-readable regressions of `current` against `baseline`.
+    Only throughput and peak RSS are compared; CPU utilisation is informational.
+    """
+    previous = {(r["mode"], r["operation"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["mode"], result["operation"], result["size"]))
+        if old is None:
+            continue
+        name = f"{result['operation']} {result['mode']} {size_label(result['size'])}"
+        if result["mb_per_s"] < old["mb_per_s"] * (1 - tolerance / 100):
+            regressions.append(f"{name}: throughput {old['mb_per_s']:.1f} -> {result['mb_per_s']:.1f} MB/s")
+        if result["peak_rss_bytes"] > old["peak_rss_bytes"] * (1 + tolerance / 100):
+            regressions.append(f"{name}: peak RSS {old['peak_rss_bytes'] / 1024 ** 2:.1f} -> "
+                               f"{result['peak_rss_bytes'] / 1024 ** 2:.1f} MB")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the Data Encrypter engine.")
+    parser.add_argument("--sizes", default="1K,1M,16M,256M",
+                        help="comma-separated file sizes, e.g. 1K,1M,1G (default: %(default)s)")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help=f"comma-separated modes out of {', '.join(MODES)} (default: all)")
+    parser.add_argument("--work-dir", default="benchmark-data",
+                        help="where synthetic files are generated and kept (default: %(default)s)")
+    parser.add_argument("--legacy-max", default="1G",
+                        help="largest size run through the whole-file path (default: %(default)s)")
+    parser.add_argument("--output", default="benchmark-report.json", help="JSON report path")
+    parser.add_argument("--compare", metavar="REPORT", help="previous report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=10,
+                        help="allowed slowdown / RSS growth in percent (default: %(default)s)")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_case"]:
+        print(json.dumps(run_case(*argv[1:])))
+        return 0
+
+    args = build_parser().parse_args(argv)
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(f"error: unknown mode(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+
+    report = {
+        "report_version": 1,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "cryptography": cryptography.__version__,
+        },
+        "results": run_benchmark(sizes, modes, args.work_dir, parse_size(args.legacy_max)),
+    }
+    # Measured after the cases: the memory-hard KDFs grow this process, and
+    # no case should start from a larger parent.
+    report["kdf"] = measure_kdfs()
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare_reports(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
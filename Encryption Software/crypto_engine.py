@@ -0,0 +1,2080 @@
+"""
+Streaming file encryption engine used by the Data Encrypter GUI.
+
+This module never imports Qt, so it can be used from scripts and cron jobs:
+
+    python -m crypto_engine encrypt backup.img --password-env BACKUP_PASSWORD
+    python -m crypto_engine decrypt - -o - --password-file pw.txt < in > out
+    python -m crypto_engine batch encrypt /srv/exports --jobs 8
+    python -m crypto_engine range dump.sqlite.encrypted --offset 4096 --length 65536
+    python -m crypto_engine verify /srv/archive --jobs 8
+    python -m crypto_engine rotate /srv/archive --new-password-env NEW_PASSWORD
+"""
+import argparse
+import base64
+import ctypes
+import functools
+import getpass
+import hashlib
+import hmac
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives import hmac as crypto_hmac
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.backends import default_backend
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # cryptography < 44
+    Argon2id = None
+
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+# Streaming container format:
+#   MAGIC | version (1 byte) | header length (4 bytes) | JSON header
+#   then a sequence of chunks, each stored as: token length (4 bytes) | token
+# With the "fernet" cipher a token is a Fernet token (base64). With an AEAD
+# cipher it is raw binary: flags (1 byte) | ciphertext | 16-byte tag, where
+# the nonce is the chunk index and the index and flags are associated data.
+# Every chunk token authenticates its own index and a "final" flag, so chunks
+# that are dropped, truncated or reordered are rejected on decryption. The top
+# bit of the final chunk's length is also set so readers can stop without
+# decrypting ahead; the authenticated flag remains the source of truth.
+MAGIC = b"DENC"
+# Version 1 headers only supported PBKDF2 ("kdf": "pbkdf2-sha256" plus a
+# top-level "iterations"); version 2 records the KDF name and all of its
+# parameters as an object, e.g. {"name": "scrypt", "n": 32768, "r": 8, "p": 1}.
+# Version 3 adds optional per-chunk compression: the header records
+# {"codec": ..., "level": ...} and compressed chunks carry _FLAG_COMPRESSED.
+# Version 4 adds "cipher"; files without it use Fernet.
+# Version 5 appends a chunk index after the final chunk (see _build_index),
+# so readers can seek to any chunk without walking the file.
+# Version 6 encrypts the chunks with a random data key and stores it in the
+# header as "wrapped_key", wrapped by a key derived from the password (see
+# _wrap_data_key). The header is padded with spaces to _HEADER_RESERVE so a
+# password change can rewrite it in place without touching the chunks.
+FORMAT_VERSION = 6
+SUPPORTED_VERSIONS = (1, 2, 3, 4, 5, 6)
+CIPHERS = ("aes-256-gcm", "chacha20-poly1305", "fernet")
+DEFAULT_CIPHER = "aes-256-gcm"
+CHUNK_SIZE = 1024 * 1024
+SALT_SIZE = 16
+PBKDF2_ITERATIONS = 480000
+DEFAULT_KDF = {"name": "pbkdf2-sha256", "iterations": PBKDF2_ITERATIONS}
+# Starting points for new files when no calibrated settings are saved.
+KDF_DEFAULTS = {
+    "pbkdf2-sha256": DEFAULT_KDF,
+    "scrypt": {"name": "scrypt", "n": 2 ** 15, "r": 8, "p": 1},
+    "argon2id": {"name": "argon2id", "iterations": 3, "lanes": 4, "memory_cost": 64 * 1024},
+}
+ENCRYPTED_SUFFIX = ".encrypted"
+DECRYPTED_SUFFIX = ".decrypted"
+# Files smaller than this are not worth spinning up a process pool for.
+PARALLEL_MIN_SIZE = 8 * CHUNK_SIZE
+# Output files are written through a buffer this large, so the small length
+# prefixes are coalesced with their tokens instead of hitting the disk alone.
+WRITE_BUFFER_SIZE = CHUNK_SIZE
+# "none": leave flushing to the OS, "file": fsync the data before the rename,
+# "full": also fsync the directory so the rename itself survives a crash.
+FSYNC_POLICIES = ("none", "file", "full")
+DEFAULT_FSYNC = "file"
+
+_PREAMBLE = struct.Struct(">4sBI")
+_CHUNK_LENGTH = struct.Struct(">I")
+_CHUNK_PREFIX = struct.Struct(">QB")
+_FLAG_FINAL = 0x01
+_FLAG_COMPRESSED = 0x02
+_LENGTH_FINAL_BIT = 0x80000000
+_MAX_HEADER_SIZE = 64 * 1024
+_HEADER_RESERVE = 1024
+_DATA_KEY_SIZE = 32
+_WRAP_NONCE_SIZE = 12
+_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Chunk index: one offset (relative to the first chunk) per chunk, then
+# chunk count | plaintext size | _INDEX_MAGIC.
+_INDEX_ENTRY = struct.Struct(">Q")
+_INDEX_FOOTER = struct.Struct(">QQ4s")
+_INDEX_MAGIC = b"DIDX"
+
+
+class EncryptionFormatError(Exception):
+    """Raised when an encrypted file is malformed, truncated or tampered with."""
+
+
+class OperationCancelled(Exception):
+    """Raised when an encrypt/decrypt job is cancelled part way through."""
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise OperationCancelled("Operation cancelled by user.")
+
+
+def _derive_pbkdf2(password, salt, params):
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt,
+                     iterations=params["iterations"], backend=default_backend())
+    return kdf.derive(password)
+
+
+def _derive_scrypt(password, salt, params):
+    kdf = Scrypt(salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"],
+                 backend=default_backend())
+    return kdf.derive(password)
+
+
+def _derive_argon2id(password, salt, params):
+    if Argon2id is None:
+        raise EncryptionFormatError("Argon2id requires cryptography 44 or newer.")
+    kdf = Argon2id(salt=salt, length=32, iterations=params["iterations"],
+                   lanes=params["lanes"], memory_cost=params["memory_cost"])
+    return kdf.derive(password)
+
+
+# name -> (derive function, {parameter: (minimum, maximum)})
+# The bounds reject headers that would make decryption hang or exhaust memory.
+KDFS = {
+    "pbkdf2-sha256": (_derive_pbkdf2, {"iterations": (1000, 50_000_000)}),
+    "scrypt": (_derive_scrypt, {"n": (2 ** 10, 2 ** 22), "r": (1, 32), "p": (1, 16)}),
+    "argon2id": (_derive_argon2id, {"iterations": (1, 100), "lanes": (1, 64),
+                                    "memory_cost": (8 * 1024, 4 * 1024 * 1024)}),
+}
+
+
+def validate_kdf(kdf) -> dict:
+    """Checks a KDF description (from a header or settings) and returns a clean copy."""
+    try:
+        name = kdf["name"]
+        _, bounds = KDFS[name]
+        params = {"name": name}
+        for param, (low, high) in bounds.items():
+            value = int(kdf[param])
+            if not low <= value <= high:
+                raise ValueError(param)
+            params[param] = value
+    except (KeyError, TypeError, ValueError):
+        raise EncryptionFormatError(f"Unsupported or invalid KDF parameters: {kdf!r}")
+    if name == "scrypt" and params["n"] & (params["n"] - 1):
+        raise EncryptionFormatError("scrypt n must be a power of two.")
+    return params
+
+
+def kdf_cache_key(kdf) -> tuple:
+    """Hashable form of a KDF description, used in key cache lookups."""
+    return tuple(sorted(kdf.items()))
+
+
+def derive_key(password: bytes, salt: bytes, kdf: dict = DEFAULT_KDF) -> bytes:
+    """Derives a Fernet key from a password and salt with the given KDF."""
+    derive, _ = KDFS[kdf["name"]]
+    return base64.urlsafe_b64encode(derive(password, salt, kdf))
+
+
+def calibrate_kdf(name: str, target_seconds: float = 0.25) -> dict:
+    """
+    Benchmarks this machine and returns parameters for `name` that take roughly
+    `target_seconds` to derive a key.
+    """
+    password, salt = b"calibration", os.urandom(SALT_SIZE)
+
+    def measure(kdf):
+        started = time.perf_counter()
+        derive_key(password, salt, kdf)
+        return time.perf_counter() - started
+
+    if name == "pbkdf2-sha256":
+        # Cost is linear in the iteration count.
+        probe = {"name": name, "iterations": 100_000}
+        iterations = int(probe["iterations"] * target_seconds / measure(probe))
+        return validate_kdf({"name": name, "iterations": max(10_000, iterations // 10_000 * 10_000)})
+
+    if name == "scrypt":
+        # Double n (memory and time) until the target is reached.
+        kdf = {"name": name, "n": 2 ** 14, "r": 8, "p": 1}
+        while kdf["n"] < 2 ** 20 and measure(kdf) * 2 <= target_seconds:
+            kdf["n"] *= 2
+        return validate_kdf(kdf)
+
+    if name == "argon2id":
+        # Keep 64 MiB unless even one pass is too slow, then scale passes.
+        kdf = dict(KDF_DEFAULTS["argon2id"], iterations=1)
+        elapsed = measure(kdf)
+        while elapsed > target_seconds and kdf["memory_cost"] > 8 * 1024:
+            kdf["memory_cost"] //= 2
+            elapsed = measure(kdf)
+        kdf["iterations"] = max(1, min(100, round(target_seconds / elapsed)))
+        return validate_kdf(kdf)
+
+    raise ValueError(f"Unknown KDF: {name}")
+
+
+def _zlib_compress(data, level):
+    return zlib.compress(data, level)
+
+
+def _zlib_decompress(data, limit):
+    decompressor = zlib.decompressobj()
+    output = decompressor.decompress(data, limit)
+    if not decompressor.eof or decompressor.unconsumed_tail or decompressor.unused_data:
+        raise ValueError("zlib stream is incomplete or too large")
+    return output
+
+
+def _lzma_compress(data, level):
+    return lzma.compress(data, preset=level)
+
+
+def _lzma_decompress(data, limit):
+    decompressor = lzma.LZMADecompressor()
+    output = decompressor.decompress(data, limit)
+    if not decompressor.eof or decompressor.unused_data:
+        raise ValueError("lzma stream is incomplete or too large")
+    return output
+
+
+def _zstd_compress(data, level):
+    return zstd.compress(data, level=level)
+
+
+def _zstd_decompress(data, limit):
+    if hasattr(zstd, "ZstdDecompressor") and hasattr(zstd.ZstdDecompressor, "eof"):
+        decompressor = zstd.ZstdDecompressor()
+        output = decompressor.decompress(data, limit)
+        if not decompressor.eof or decompressor.unused_data:
+            raise ValueError("zstd stream is incomplete or too large")
+        return output
+    # The zstandard package: frames written by compress() carry their size.
+    return zstd.ZstdDecompressor().decompress(data, max_output_size=limit)
+
+
+# name -> (compress, decompress, (minimum level, maximum level), default level)
+# Codecs whose module is missing from this Python are left out.
+CODECS = {"zlib": (_zlib_compress, _zlib_decompress, (1, 9), 6)}
+if lzma is not None:
+    CODECS["lzma"] = (_lzma_compress, _lzma_decompress, (0, 9), 6)
+if zstd is not None:
+    CODECS["zstd"] = (_zstd_compress, _zstd_decompress, (1, 22), 3)
+ALL_CODECS = ("zlib", "lzma", "zstd")
+
+# Before compressing a chunk, a sample of it is compressed at the fastest zlib
+# level; chunks that don't shrink by at least 10% are stored as they are.
+_COMPRESSION_SAMPLE = 16 * 1024
+_COMPRESSION_MIN_SAVING = 0.10
+
+
+def validate_compression(compression):
+    """
+    Checks a compression description ({"codec": ..., "level": ...}, or None
+    for no compression) and returns a clean copy with the level filled in.
+    """
+    if compression is None:
+        return None
+    try:
+        codec = compression["codec"]
+        if codec not in ALL_CODECS:
+            raise ValueError(codec)
+        if codec not in CODECS:
+            raise EncryptionFormatError(f"The {codec} codec is not available in this Python installation.")
+        _, _, (low, high), default = CODECS[codec]
+        level = int(compression.get("level", default))
+        if not low <= level <= high:
+            raise ValueError(level)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise EncryptionFormatError(f"Unsupported or invalid compression: {compression!r}")
+    return {"codec": codec, "level": level}
+
+
+def _compress_chunk(chunk, compression):
+    """Returns the compressed chunk, or None when compression doesn't pay off."""
+    if len(chunk) > 2 * _COMPRESSION_SAMPLE:
+        start = (len(chunk) - _COMPRESSION_SAMPLE) // 2
+        sample = chunk[start:start + _COMPRESSION_SAMPLE]
+        if len(zlib.compress(sample, 1)) > len(sample) * (1 - _COMPRESSION_MIN_SAVING):
+            return None
+    compress, _, _, _ = CODECS[compression["codec"]]
+    compressed = compress(chunk, compression["level"])
+    return compressed if len(compressed) < len(chunk) else None
+
+
+def _decompress_chunk(data, codec, limit):
+    _, decompress, _, _ = CODECS[codec]
+    try:
+        return decompress(data, limit)
+    except Exception:
+        raise EncryptionFormatError("A compressed chunk is corrupted.")
+
+
+def kdf_settings_path():
+    """Location of the calibrated KDF settings shared by the GUI and CLI."""
+    base = os.environ.get("APPDATA") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "data-encrypter", "kdf.json")
+
+
+def load_kdf_settings(name=None) -> dict:
+    """
+    Returns the saved KDF settings, or the defaults when none are saved. With
+    `name`, returns parameters for that KDF (saved ones if they match).
+    """
+    try:
+        with open(kdf_settings_path(), encoding="utf-8") as file:
+            saved = validate_kdf(json.load(file))
+    except (OSError, ValueError, EncryptionFormatError):
+        saved = None
+    if name is None:
+        return saved or DEFAULT_KDF
+    if saved is not None and saved["name"] == name:
+        return saved
+    return KDF_DEFAULTS[name]
+
+
+def save_kdf_settings(kdf: dict):
+    path = kdf_settings_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with AtomicWriter(path) as file:
+        file.write(json.dumps(validate_kdf(kdf), indent=2).encode("utf-8"))
+
+
+def derive_file_key(master_key: bytes, file_salt: bytes, cipher: str = "fernet") -> bytes:
+    """
+    Derives a per-file key from a master Fernet key using HKDF: a Fernet key
+    for the "fernet" cipher, or 32 raw bytes for the AEAD ciphers.
+    """
+    info = b"data-encrypter file key" if cipher == "fernet" else f"data-encrypter {cipher} key".encode()
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=file_salt,
+        info=info,
+        backend=default_backend()
+    )
+    key = hkdf.derive(base64.urlsafe_b64decode(master_key))
+    return base64.urlsafe_b64encode(key) if cipher == "fernet" else key
+
+
+def _wrap_aad(file_salt, chunk_size, cipher, compression):
+    """
+    Header fields that never change after encryption. They are bound to the
+    wrapped key, so editing any of them makes the key fail to unwrap.
+    """
+    fields = {"file_salt": file_salt.hex(), "chunk_size": chunk_size, "cipher": cipher,
+              "compression": compression}
+    return json.dumps(fields, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _wrapping_key(master_key, file_salt):
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=file_salt,
+        info=b"data-encrypter key wrap",
+        backend=default_backend()
+    )
+    return hkdf.derive(base64.urlsafe_b64decode(master_key))
+
+
+def _wrap_data_key(master_key, data_key, file_salt, aad):
+    """Encrypts a data key with AES-256-GCM: nonce | ciphertext | tag."""
+    nonce = os.urandom(_WRAP_NONCE_SIZE)
+    return nonce + AESGCM(_wrapping_key(master_key, file_salt)).encrypt(nonce, data_key, aad)
+
+
+def _unwrap_data_key(master_key, wrapped_key, file_salt, aad):
+    try:
+        return AESGCM(_wrapping_key(master_key, file_salt)).decrypt(
+            wrapped_key[:_WRAP_NONCE_SIZE], wrapped_key[_WRAP_NONCE_SIZE:], aad)
+    except InvalidTag:
+        # Wrong password, or a tampered header.
+        raise InvalidToken
+
+
+def _chunk_key(data_key, cipher):
+    """The key the chunks of an envelope file are encrypted with."""
+    return base64.urlsafe_b64encode(data_key) if cipher == "fernet" else data_key
+
+
+def _lock_memory(buffer, lock=True):
+    """Best-effort pinning of a bytearray in RAM so it is never written to swap."""
+    if not buffer:
+        return False
+    try:
+        address = ctypes.addressof((ctypes.c_char * len(buffer)).from_buffer(buffer))
+        if sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            function = kernel32.VirtualLock if lock else kernel32.VirtualUnlock
+        else:
+            libc = ctypes.CDLL(None)
+            function = libc.mlock if lock else libc.munlock
+        function.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        result = function(address, len(buffer))
+        # VirtualLock returns non-zero on success, mlock returns 0.
+        return result != 0 if sys.platform == "win32" else result == 0
+    except (OSError, AttributeError, ValueError):
+        return False
+
+
+class _MappedReader:
+    """
+    Read-only stream over a memory-mapped file.
+
+    `read` returns memoryview slices of the mapping instead of copying bytes.
+    Pages that have been read are periodically dropped from the process, so
+    resident memory stays flat however large the file is.
+    """
+
+    RELEASE_STEP = 16 * 1024 * 1024
+
+    def __init__(self, mapping):
+        self._mapping = mapping
+        self._view = memoryview(mapping)
+        self._position = 0
+        self._released = 0
+        if hasattr(mapping, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+
+    def read(self, size=-1):
+        start = self._position
+        end = len(self._view) if size < 0 else min(len(self._view), start + size)
+        self._position = end
+        if end - self._released >= self.RELEASE_STEP:
+            self._release_pages(start)
+        return self._view[start:end]
+
+    def tell(self):
+        return self._position
+
+    def _release_pages(self, upto):
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        length = (upto - self._released) // mmap.PAGESIZE * mmap.PAGESIZE
+        if length > 0:
+            # Pages of a read-only file mapping are simply re-read on access.
+            self._mapping.madvise(mmap.MADV_DONTNEED, self._released, length)
+            self._released += length
+
+    def close(self):
+        self._view.release()
+        self._mapping.close()
+
+
+class _open_mapped:
+    """Context manager mapping a file for reading, or falling back to the file itself."""
+
+    def __init__(self, file):
+        self._file = file
+        self._reader = None
+
+    def __enter__(self):
+        try:
+            self._reader = _MappedReader(mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ))
+        except (ValueError, OSError):
+            # Empty files and special files cannot be mapped.
+            return self._file
+        return self._reader
+
+    def __exit__(self, *exc_info):
+        if self._reader is not None:
+            try:
+                self._reader.close()
+            except BufferError:
+                # A slice is still referenced somewhere; the mapping is freed with it.
+                pass
+        return False
+
+
+class AtomicWriter:
+    """
+    Writable file that only replaces `path` once everything has been written.
+
+    Data goes to a temporary file in the same directory, which is renamed over
+    `path` when the context exits cleanly. If an exception escapes, the
+    temporary file is removed and an existing `path` is left untouched, so a
+    crash or a wrong password never leaves a half-written file behind. An
+    existing `path` keeps its permission bits.
+    """
+
+    def __init__(self, path, fsync: str = DEFAULT_FSYNC, buffer_size: int = WRITE_BUFFER_SIZE):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.fsync = fsync
+        self._buffer_size = buffer_size
+        self._temp_path = None
+        self._file = None
+
+    def __enter__(self):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+        while True:
+            self._temp_path = os.path.join(directory, f".{name}.{os.urandom(4).hex()}.tmp")
+            try:
+                # 0o666 so the umask applies, as it would with open(path, 'wb').
+                descriptor = os.open(self._temp_path, flags, 0o666)
+                break
+            except FileExistsError:
+                continue
+        try:
+            # Replacing a file must not loosen its permissions (a 0600 archive
+            # would otherwise come back as 0644 after a rotate).
+            shutil.copymode(self.path, self._temp_path)
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            os.close(descriptor)
+            remove_quietly(self._temp_path)
+            raise
+        self._file = os.fdopen(descriptor, 'wb', buffering=self._buffer_size)
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._file.close()
+            remove_quietly(self._temp_path)
+            return False
+        try:
+            self._file.flush()
+            if self.fsync != "none":
+                os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        except BaseException:
+            self._file.close()
+            remove_quietly(self._temp_path)
+            raise
+        if self.fsync == "full":
+            _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+        return False
+
+
+def _fsync_directory(directory):
+    """Makes a rename in `directory` durable (not possible on Windows)."""
+    if sys.platform == "win32":
+        return
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class EventBus:
+    """
+    Fans engine events out to any number of subscribers. Pass an instance (or
+    any `callback(name, fields)`) as the `events` argument of an operation;
+    see _Instrument for the events and their fields. Batch operations call
+    subscribers from several threads at once.
+    """
+
+    def __init__(self, *subscribers):
+        self._subscribers = list(subscribers)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def __call__(self, name, fields):
+        for callback in list(self._subscribers):
+            callback(name, fields)
+
+
+class JsonMetricsLog:
+    """Event subscriber appending one JSON object per event to a log file."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, name, fields):
+        line = json.dumps(dict(fields, event=name, time=round(time.time(), 6)), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class _TimedStream:
+    """Wraps a source or destination, adding up bytes moved and time spent."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self._stream.read(size)
+        self.seconds += time.perf_counter() - started
+        self.bytes += len(data)
+        return data
+
+    def write(self, data):
+        started = time.perf_counter()
+        result = self._stream.write(data)
+        self.seconds += time.perf_counter() - started
+        self.bytes += len(data)
+        return result
+
+
+class _Instrument:
+    """
+    Measures one encrypt/decrypt/verify operation and reports it to an
+    `events(name, fields)` callback. Every event carries "operation":
+
+      "start"   -
+      "kdf"     kdf, seconds (near zero when the key was cached)
+      "chunk"   index, bytes_read, bytes_written, read_seconds, crypto_seconds,
+                write_seconds
+      "finish"  bytes_read, bytes_written, plaintext_bytes, chunks, seconds,
+                kdf_seconds, read_seconds, crypto_seconds, write_seconds and
+                throughput (plaintext bytes per second after key derivation)
+
+    Reads and writes are timed by wrapping the streams, so comparing
+    read/write time with crypto time tells a slow disk from a slow CPU. With
+    parallel workers, chunks are read ahead and crypto time is summed across
+    processes. Without a callback nothing is wrapped or timed.
+    """
+
+    def __init__(self, events, operation, source, destination):
+        self.events = events
+        self.operation = operation
+        self.source, self.destination = source, destination
+        if events is None:
+            return
+        self.source, self.destination = _TimedStream(source), _TimedStream(destination)
+        self.started = time.perf_counter()
+        self.kdf_seconds = 0.0
+        self.crypto_seconds = 0.0
+        self.chunks = 0
+        self._last = (0, 0, 0.0, 0.0)
+        self._last_chunk_time = self.started
+        self._emit("start", {})
+
+    def _emit(self, name, fields):
+        fields["operation"] = self.operation
+        self.events(name, fields)
+
+    def kdf(self, kdf, seconds):
+        if self.events is None:
+            return
+        self.kdf_seconds += seconds
+        self._last_chunk_time = time.perf_counter()
+        self._emit("kdf", {"kdf": kdf["name"] if isinstance(kdf, dict) else kdf, "seconds": seconds})
+
+    def chunk(self, crypto_seconds=None):
+        """Reports one chunk; without `crypto_seconds`, time not spent on I/O is counted."""
+        if self.events is None:
+            return
+        now = time.perf_counter()
+        current = (self.source.bytes, self.destination.bytes, self.source.seconds, self.destination.seconds)
+        read, written, read_seconds, write_seconds = (value - last for value, last in zip(current, self._last))
+        if crypto_seconds is None:
+            crypto_seconds = max(0.0, now - self._last_chunk_time - read_seconds - write_seconds)
+        self._last, self._last_chunk_time = current, now
+        self.crypto_seconds += crypto_seconds
+        self._emit("chunk", {"index": self.chunks, "bytes_read": read, "bytes_written": written,
+                             "read_seconds": read_seconds, "crypto_seconds": crypto_seconds,
+                             "write_seconds": write_seconds})
+        self.chunks += 1
+
+    def finish(self, plaintext_bytes):
+        if self.events is None:
+            return
+        seconds = time.perf_counter() - self.started
+        data_seconds = seconds - self.kdf_seconds
+        self._emit("finish", {
+            "bytes_read": self.source.bytes, "bytes_written": self.destination.bytes,
+            "plaintext_bytes": plaintext_bytes, "chunks": self.chunks, "seconds": seconds,
+            "kdf_seconds": self.kdf_seconds, "read_seconds": self.source.seconds,
+            "crypto_seconds": self.crypto_seconds, "write_seconds": self.destination.seconds,
+            "throughput": plaintext_bytes / data_seconds if data_seconds > 0 else 0.0,
+        })
+
+    def derive(self, derive, kdf, *args):
+        """Calls a key derivation, reporting how long it took."""
+        started = time.perf_counter()
+        key = derive(*args)
+        self.kdf(kdf, time.perf_counter() - started)
+        return key
+
+
+def _with_fields(events, **extra):
+    """Returns an events callback that adds `extra` to every event's fields."""
+    if events is None:
+        return None
+    return lambda name, fields: events(name, dict(fields, **extra))
+
+
+class KeyCache:
+    """
+    In-memory cache of derived master keys with a TTL and LRU eviction.
+
+    Entries are keyed by (password fingerprint, salt, KDF parameters), so the
+    password itself is never stored. Key material is held in locked bytearrays
+    where the OS allows it and is zeroed when evicted, expired or wiped.
+    """
+
+    def __init__(self, ttl: float = 15 * 60, max_entries: int = 32):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Per-process secret so fingerprints are useless outside this process.
+        self._fingerprint_key = os.urandom(32)
+
+    def fingerprint(self, password: bytes) -> bytes:
+        return hmac.new(self._fingerprint_key, password, hashlib.sha256).digest()
+
+    def get(self, password: bytes, salt: bytes, params):
+        """Returns the cached key, or None if it is missing or expired."""
+        cache_key = (self.fingerprint(password), salt, params)
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(cache_key)
+            return bytes(entry[0])
+
+    def put(self, password: bytes, salt: bytes, params, key: bytes):
+        cache_key = (self.fingerprint(password), salt, params)
+        buffer = bytearray(key)
+        locked = _lock_memory(buffer)
+        with self._lock:
+            if cache_key in self._entries:
+                self._wipe_entry(self._entries.pop(cache_key))
+            self._entries[cache_key] = (buffer, time.monotonic() + self.ttl, locked)
+            while len(self._entries) > self.max_entries:
+                self._wipe_entry(self._entries.popitem(last=False)[1])
+
+    def salt_for(self, password: bytes, params):
+        """Returns the salt of the newest live entry for this password, if any."""
+        fingerprint = self.fingerprint(password)
+        with self._lock:
+            self._purge_expired()
+            for entry_fingerprint, salt, entry_params in reversed(self._entries):
+                if entry_fingerprint == fingerprint and entry_params == params:
+                    return salt
+        return None
+
+    def purge_expired(self):
+        with self._lock:
+            self._purge_expired()
+
+    def wipe(self):
+        """Zeroes and drops every cached key."""
+        with self._lock:
+            while self._entries:
+                self._wipe_entry(self._entries.popitem()[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for cache_key in [k for k, (_, expires, _) in self._entries.items() if expires <= now]:
+            self._wipe_entry(self._entries.pop(cache_key))
+
+    @staticmethod
+    def _wipe_entry(entry):
+        buffer, _, locked = entry
+        buffer[:] = bytes(len(buffer))
+        if locked:
+            _lock_memory(buffer, lock=False)
+
+
+class KeyProvider:
+    """
+    Derives master keys from one password, once per (salt, KDF parameters).
+
+    A batch shares a single provider, so the KDF runs once for the whole batch
+    and every file then gets its own random data key wrapped by it. With a
+    KeyCache, keys also survive across providers (e.g. repeated GUI jobs), and
+    encryption reuses the cached salt so repeat encryptions skip the KDF too.
+    `kdf` selects the KDF used for new files (default: PBKDF2-SHA256).
+    """
+
+    def __init__(self, password: bytes, cache: KeyCache = None, kdf: dict = None):
+        self._password = password
+        self._master_keys = {}
+        # Guards the two dicts only; each derivation holds its own entry of
+        # _derive_locks, so different salts or KDFs derive concurrently while
+        # jobs asking for the same key wait for the first one to finish.
+        self._lock = threading.Lock()
+        self._derive_locks = {}
+        self.cache = cache
+        self.kdf = validate_kdf(kdf or DEFAULT_KDF)
+        # Salt used for everything this provider encrypts. Every file still gets
+        # a unique key because of its own HKDF salt.
+        salt = cache.salt_for(password, kdf_cache_key(self.kdf)) if cache else None
+        self.salt = salt or os.urandom(SALT_SIZE)
+
+    def master_key(self, salt: bytes, kdf: dict = DEFAULT_KDF) -> bytes:
+        params = kdf_cache_key(kdf)
+        with self._lock:
+            key = self._master_keys.get((salt, params))
+            if key is not None:
+                return key
+            derive_lock = self._derive_locks.setdefault((salt, params), threading.Lock())
+        with derive_lock:
+            with self._lock:
+                key = self._master_keys.get((salt, params))
+            if key is not None:
+                return key
+            if self.cache is not None:
+                key = self.cache.get(self._password, salt, params)
+            if key is None:
+                key = derive_key(self._password, salt, kdf)
+                if self.cache is not None:
+                    self.cache.put(self._password, salt, params, key)
+            with self._lock:
+                self._master_keys[(salt, params)] = key
+                del self._derive_locks[(salt, params)]
+            return key
+
+
+def _as_key_provider(password):
+    return password if isinstance(password, KeyProvider) else KeyProvider(password)
+
+
+def _read_exact(stream, size):
+    """Reads up to `size` bytes, looping over short reads from pipes."""
+    data = stream.read(size)
+    # A complete read is returned as-is, so mapped readers stay zero-copy.
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+def _max_token_length(chunk_size, cipher="fernet"):
+    """Upper bound on the size of one chunk's token."""
+    if cipher != "fernet":
+        # flags + ciphertext + tag
+        return 1 + chunk_size + 16
+    # version + timestamp + IV + padded ciphertext + HMAC, then base64
+    raw = 1 + 8 + 16 + (chunk_size + _CHUNK_PREFIX.size + 16) + 32
+    return (raw + 2) // 3 * 4
+
+
+def _new_cipher(cipher, key):
+    if cipher == "fernet":
+        return Fernet(key)
+    if cipher == "aes-256-gcm":
+        return AESGCM(key)
+    return ChaCha20Poly1305(key)
+
+
+# Cipher instance for chunk tasks running inside a pool worker process.
+_worker_cipher = None
+
+
+def _init_chunk_worker(cipher, key):
+    global _worker_cipher
+    _worker_cipher = _new_cipher(cipher, key)
+
+
+def _workers_for(source, workers):
+    """Returns `workers`, or 1 if `source` is too small to be worth a process pool."""
+    return workers if os.fstat(source.fileno()).st_size >= PARALLEL_MIN_SIZE else 1
+
+
+def _run_chunk_task(task, *args):
+    started = time.perf_counter()
+    result = task(_worker_cipher, *args)
+    return time.perf_counter() - started, result
+
+
+def _maybe_compress(flags, chunk, compression):
+    if compression is not None:
+        compressed = _compress_chunk(chunk, compression)
+        if compressed is not None:
+            return flags | _FLAG_COMPRESSED, compressed
+    return flags, chunk
+
+
+def _maybe_decompress(flags, body, codec, chunk_size):
+    if not flags & _FLAG_COMPRESSED:
+        return body
+    if codec is None:
+        raise EncryptionFormatError("Compressed chunk in a file without compression.")
+    return _decompress_chunk(body, codec, chunk_size)
+
+
+def _encrypt_chunk(fernet, index, flags, chunk, compression=None):
+    flags, data = _maybe_compress(flags, chunk, compression)
+    return len(chunk), flags, fernet.encrypt(_CHUNK_PREFIX.pack(index, flags) + data)
+
+
+def _decrypt_chunk(fernet, token, codec=None, chunk_size=CHUNK_SIZE):
+    """Returns (token length, chunk index, flags, plaintext) for a Fernet chunk."""
+    # Fernet only accepts bytes, so a mapped token is copied one chunk at a time.
+    plaintext = fernet.decrypt(bytes(token))
+    if len(plaintext) < _CHUNK_PREFIX.size:
+        raise EncryptionFormatError("A chunk is corrupted.")
+    index, flags = _CHUNK_PREFIX.unpack_from(plaintext)
+    body = _maybe_decompress(flags, plaintext[_CHUNK_PREFIX.size:], codec, chunk_size)
+    return len(token), index, flags, body
+
+
+def _aead_nonce(index):
+    # Every file has its own key, so the chunk index never repeats under a key.
+    return index.to_bytes(12, "big")
+
+
+def _encrypt_aead_chunk(aead, index, flags, chunk, compression=None):
+    flags, data = _maybe_compress(flags, chunk, compression)
+    return len(chunk), flags, aead.encrypt(_aead_nonce(index), data, _CHUNK_PREFIX.pack(index, flags))
+
+
+def _decrypt_aead_chunk(aead, index, token, codec=None, chunk_size=CHUNK_SIZE):
+    """Returns (token length, chunk index, flags, plaintext) for an AEAD chunk."""
+    if not token:
+        raise EncryptionFormatError("A chunk is corrupted.")
+    flags = token[0]
+    try:
+        plaintext = aead.decrypt(_aead_nonce(index), memoryview(token)[1:], _CHUNK_PREFIX.pack(index, flags))
+    except InvalidTag:
+        # Reported like a failed Fernet token: wrong password or tampered data.
+        raise InvalidToken
+    return len(token), index, flags, _maybe_decompress(flags, plaintext, codec, chunk_size)
+
+
+def _map_chunks(task, items, cipher, key, workers, cancel_event):
+    """
+    Applies `task(cipher_instance, *item)` to every item and yields
+    (seconds taken, result) pairs in order.
+
+    With more than one worker the chunks are processed on a process pool. At
+    most two chunks per worker are in flight, so memory use stays bounded.
+    """
+    if workers <= 1:
+        instance = _new_cipher(cipher, key)
+        for item in items:
+            _check_cancelled(cancel_event)
+            started = time.perf_counter()
+            result = task(instance, *item)
+            yield time.perf_counter() - started, result
+        return
+
+    # "spawn" on every platform: forking a process that runs Qt or other
+    # threads (batch jobs, the key derivation) can deadlock the children.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_chunk_worker, initargs=(cipher, key)) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                _check_cancelled(cancel_event)
+                # Memoryviews of a mapped file cannot be pickled to the workers.
+                item = [bytes(value) if isinstance(value, memoryview) else value for value in item]
+                pending.append(executor.submit(_run_chunk_task, task, *item))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                _check_cancelled(cancel_event)
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _iter_plain_chunks(source, chunk_size):
+    """Yields (index, flags, chunk), looking one chunk ahead to flag the last one."""
+    index = 0
+    chunk = _read_exact(source, chunk_size)
+    while True:
+        next_chunk = _read_exact(source, chunk_size)
+        flags = 0 if next_chunk else _FLAG_FINAL
+        yield index, flags, chunk
+        if flags & _FLAG_FINAL:
+            return
+        chunk = next_chunk
+        index += 1
+
+
+def _iter_tokens(source, max_token):
+    """Yields the chunk tokens of a streaming file up to the marked final chunk."""
+    index = 0
+    while True:
+        length_bytes = _read_exact(source, _CHUNK_LENGTH.size)
+        if not length_bytes:
+            return
+        if len(length_bytes) < _CHUNK_LENGTH.size:
+            raise EncryptionFormatError("Encrypted file is truncated.")
+        (length_field,) = _CHUNK_LENGTH.unpack(length_bytes)
+        token_length = length_field & ~_LENGTH_FINAL_BIT
+        if token_length > max_token:
+            raise EncryptionFormatError(f"Chunk {index} has an invalid length.")
+        token = _read_exact(source, token_length)
+        if len(token) != token_length:
+            raise EncryptionFormatError("Encrypted file is truncated.")
+        yield (token,)
+        if length_field & _LENGTH_FINAL_BIT:
+            return
+        index += 1
+
+
+def encrypt_stream(source, destination, password, chunk_size: int = CHUNK_SIZE,
+                   progress=None, cancel_event=None, workers: int = 1, compression=None,
+                   cipher: str = DEFAULT_CIPHER, events=None):
+    """
+    Encrypts `source` into `destination` chunk by chunk with constant memory.
+
+    `password` is either the password bytes or a KeyProvider shared by a batch.
+    `progress` is called with the number of source bytes consumed after each
+    chunk, and `cancel_event` (a threading.Event) aborts the job when set.
+    With `workers` > 1 chunks are encrypted in parallel on a process pool and
+    written back in their original order. `compression` ({"codec": "zlib",
+    "level": 6}, see CODECS) compresses each chunk before it is encrypted,
+    skipping chunks that would not shrink. `cipher` is one of CIPHERS; the
+    AEAD ciphers store raw binary chunks, "fernet" stores base64 tokens.
+    `events` receives timing and byte counts (see _Instrument and EventBus).
+    """
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unknown cipher: {cipher}")
+    keys = _as_key_provider(password)
+    compression = validate_compression(compression)
+    file_salt = os.urandom(SALT_SIZE)
+    data_key = os.urandom(_DATA_KEY_SIZE)
+    encrypt_chunk = _encrypt_chunk if cipher == "fernet" else _encrypt_aead_chunk
+    task = functools.partial(encrypt_chunk, compression=compression)
+    instrument = _Instrument(events, "encrypt", source, destination)
+    source, destination = instrument.source, instrument.destination
+    master_key = instrument.derive(keys.master_key, keys.kdf, keys.salt, keys.kdf)
+    key = _chunk_key(data_key, cipher)
+
+    header_bytes = _encode_header(keys, master_key, data_key, file_salt, chunk_size, cipher, compression)
+    destination.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+    destination.write(header_bytes)
+
+    processed = 0
+    offsets = []
+    position = 0
+    chunks = _iter_plain_chunks(source, chunk_size)
+    for crypto_seconds, (chunk_length, flags, token) in _map_chunks(task, chunks, cipher, key, workers,
+                                                                    cancel_event):
+        processed += chunk_length
+        offsets.append(position)
+        final_bit = _LENGTH_FINAL_BIT if flags & _FLAG_FINAL else 0
+        if cipher == "fernet":
+            destination.write(_CHUNK_LENGTH.pack(len(token) | final_bit))
+            position += _CHUNK_LENGTH.size + len(token)
+        else:
+            destination.write(_CHUNK_LENGTH.pack(1 + len(token) | final_bit) + bytes((flags,)))
+            position += _CHUNK_LENGTH.size + 1 + len(token)
+        destination.write(token)
+        instrument.chunk(crypto_seconds)
+        if progress is not None:
+            progress(processed)
+    destination.write(_build_index(offsets, processed))
+    instrument.finish(processed)
+
+
+def _encode_header(keys, master_key, data_key, file_salt, chunk_size, cipher, compression):
+    """Serialises a version 6 header, padded to _HEADER_RESERVE bytes."""
+    aad = _wrap_aad(file_salt, chunk_size, cipher, compression)
+    header = {
+        "kdf": keys.kdf,
+        "salt": keys.salt.hex(),
+        "file_salt": file_salt.hex(),
+        "chunk_size": chunk_size,
+        "cipher": cipher,
+        "wrapped_key": _wrap_data_key(master_key, data_key, file_salt, aad).hex(),
+    }
+    if compression is not None:
+        header["compression"] = compression
+    # JSON ignores trailing whitespace, which leaves room for a rotated header.
+    return json.dumps(header, separators=(",", ":")).encode("utf-8").ljust(_HEADER_RESERVE)
+
+
+def _build_index(offsets, plaintext_size):
+    """
+    Serialises the chunk index written after the final chunk. It is not
+    encrypted: a wrong offset only leads a reader to a chunk that fails
+    authentication or carries the wrong index.
+    """
+    entries = b"".join(_INDEX_ENTRY.pack(offset) for offset in offsets)
+    return entries + _INDEX_FOOTER.pack(len(offsets), plaintext_size, _INDEX_MAGIC)
+
+
+_Header = namedtuple("_Header", "version salt kdf file_salt chunk_size compression cipher wrapped_key")
+
+
+def _read_header(source, prefix):
+    """Parses the preamble and JSON header that follow the magic bytes into a _Header."""
+    rest = _read_exact(source, _PREAMBLE.size - len(prefix))
+    if len(prefix) + len(rest) < _PREAMBLE.size:
+        raise EncryptionFormatError("File is too short to be an encrypted file.")
+    _, version, header_length = _PREAMBLE.unpack(bytes(prefix) + bytes(rest))
+    if version not in SUPPORTED_VERSIONS:
+        raise EncryptionFormatError(f"Unsupported format version {version}.")
+    if header_length > _MAX_HEADER_SIZE:
+        raise EncryptionFormatError("Header is too large.")
+    header_bytes = _read_exact(source, header_length)
+    if len(header_bytes) != header_length:
+        raise EncryptionFormatError("File header is truncated.")
+    try:
+        header = json.loads(bytes(header_bytes))
+        chunk_size = int(header["chunk_size"])
+        salt = bytes.fromhex(header["salt"])
+        file_salt = bytes.fromhex(header["file_salt"]) if "file_salt" in header else None
+        kdf = header["kdf"]
+        if version == 1:
+            kdf = {"name": kdf, "iterations": header["iterations"]}
+        compression = header.get("compression") if version >= 3 else None
+        cipher = header.get("cipher", "fernet") if version >= 4 else "fernet"
+        wrapped_key = bytes.fromhex(header["wrapped_key"]) if version >= 6 else None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise EncryptionFormatError("File header is corrupted.")
+    if not 0 < chunk_size <= _MAX_CHUNK_SIZE:
+        raise EncryptionFormatError("File header is corrupted.")
+    if cipher not in CIPHERS or (cipher != "fernet" and file_salt is None):
+        raise EncryptionFormatError(f"Unsupported cipher: {cipher!r}")
+    if version >= 6 and (file_salt is None or len(wrapped_key) <= _WRAP_NONCE_SIZE):
+        raise EncryptionFormatError("File header is corrupted.")
+    return _Header(version, salt, validate_kdf(kdf), file_salt, chunk_size,
+                   validate_compression(compression), cipher, wrapped_key)
+
+
+def _file_key(keys, header):
+    """Derives the key that decrypts the chunks of a file with this header."""
+    key = keys.master_key(header.salt, header.kdf)
+    if header.wrapped_key is not None:
+        return _chunk_key(_unwrap_data_key(key, header.wrapped_key, header.file_salt,
+                                           _header_aad(header)), header.cipher)
+    if header.file_salt is not None:
+        key = derive_file_key(key, header.file_salt, header.cipher)
+    return key
+
+
+def _header_aad(header):
+    return _wrap_aad(header.file_salt, header.chunk_size, header.cipher, header.compression)
+
+
+def _chunk_decrypt_task(header):
+    """
+    Returns the chunk task for a header, taking (cipher, index, token) and
+    returning (token length, chunk index, flags, plaintext).
+    """
+    codec = header.compression["codec"] if header.compression is not None else None
+    if header.cipher == "fernet":
+        # Fernet plaintexts carry their own index, so the expected one is unused.
+        return functools.partial(_decrypt_fernet_task, codec=codec, chunk_size=header.chunk_size)
+    return functools.partial(_decrypt_aead_chunk, codec=codec, chunk_size=header.chunk_size)
+
+
+def _decrypt_fernet_task(fernet, index, token, codec=None, chunk_size=CHUNK_SIZE):
+    return _decrypt_chunk(fernet, token, codec, chunk_size)
+
+
+# Base64 characters processed per step when streaming a legacy token.
+_LEGACY_BLOCK = 4 * 1024 * 1024
+# Fernet token layout: version (1) | timestamp (8) | IV (16) | ciphertext | HMAC (32)
+_FERNET_HEADER = 25
+_FERNET_HMAC = 32
+
+
+def _decrypt_legacy(source, destination, keys, prefix, progress=None, cancel_event=None,
+                    instrument=None):
+    """
+    Decrypts the original `salt + Fernet token` whole-file format in bounded
+    blocks, producing the same result as Fernet.decrypt without holding the
+    token in memory.
+
+    The token's HMAC sits at its very end, so plaintext is written before it
+    is verified: when this raises, the output must be discarded. decrypt_stream
+    only passes destinations that are (see its `discarded_on_failure`).
+    """
+    instrument = instrument or _Instrument(None, "decrypt", source, destination)
+    salt = bytes(prefix) + bytes(_read_exact(source, SALT_SIZE - len(prefix)))
+    raw_key = base64.urlsafe_b64decode(instrument.derive(keys.master_key, DEFAULT_KDF, salt))
+    signer = crypto_hmac.HMAC(raw_key[:16], hashes.SHA256(), backend=default_backend())
+    decryptor = None
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+
+    consumed = len(salt)
+    pending = b""
+    while True:
+        _check_cancelled(cancel_event)
+        block = _read_exact(source, _LEGACY_BLOCK)
+        consumed += len(block)
+        try:
+            pending += base64.urlsafe_b64decode(block)
+        except ValueError:
+            raise InvalidToken
+        if decryptor is None and len(pending) >= _FERNET_HEADER:
+            if pending[0] != 0x80:
+                raise InvalidToken
+            iv = pending[9:_FERNET_HEADER]
+            decryptor = Cipher(algorithms.AES(raw_key[16:]), modes.CBC(iv),
+                               backend=default_backend()).decryptor()
+            signer.update(pending[:_FERNET_HEADER])
+            pending = pending[_FERNET_HEADER:]
+        if len(block) < _LEGACY_BLOCK:
+            break
+        # Hold back the last 32 bytes: they may be the HMAC.
+        if decryptor is not None and len(pending) > _FERNET_HMAC:
+            body = pending[:-_FERNET_HMAC]
+            pending = pending[-_FERNET_HMAC:]
+            signer.update(body)
+            destination.write(unpadder.update(decryptor.update(body)))
+        instrument.chunk()
+        if progress is not None:
+            progress(consumed)
+
+    if decryptor is None or len(pending) < _FERNET_HMAC:
+        raise InvalidToken
+    body, mac = pending[:-_FERNET_HMAC], pending[-_FERNET_HMAC:]
+    signer.update(body)
+    try:
+        signer.verify(mac)
+        plaintext = decryptor.update(body) + decryptor.finalize()
+        destination.write(unpadder.update(plaintext) + unpadder.finalize())
+    except (InvalidSignature, ValueError):
+        raise InvalidToken
+    instrument.chunk()
+    if progress is not None:
+        progress(consumed)
+
+
+def decrypt_stream(source, destination, password, progress=None, cancel_event=None,
+                   workers: int = 1, events=None, discarded_on_failure: bool = False):
+    """
+    Decrypts `source` into `destination`, verifying every chunk in order and
+    decompressing chunks that were compressed on encryption. The format
+    (legacy whole-file Fernet, chunked Fernet or binary AEAD) is detected
+    from the file itself.
+
+    `progress` is called with the number of encrypted bytes consumed so far;
+    `password`, `cancel_event`, `workers` and `events` behave as in
+    `encrypt_stream`. Legacy files are only authenticated at their end, so
+    their plaintext is held in a temporary file until then unless the caller
+    passes `discarded_on_failure` (e.g. for an AtomicWriter's temporary file).
+    """
+    keys = _as_key_provider(password)
+    instrument = _Instrument(events, "decrypt", source, destination)
+    source, destination = instrument.source, instrument.destination
+    prefix = _read_exact(source, len(MAGIC))
+    if prefix != MAGIC:
+        if discarded_on_failure:
+            _decrypt_legacy(source, destination, keys, prefix, progress, cancel_event, instrument)
+        else:
+            # Nothing may reach e.g. stdout before the token's HMAC is checked.
+            with tempfile.TemporaryFile() as spool:
+                _decrypt_legacy(source, spool, keys, prefix, progress, cancel_event, instrument)
+                spool.seek(0)
+                shutil.copyfileobj(spool, destination, CHUNK_SIZE)
+        instrument.finish(destination.bytes if events is not None else 0)
+        return
+
+    header = _read_header(source, prefix)
+    key = instrument.derive(_file_key, header.kdf, keys, header)
+    tokens = _iter_tokens(source, _max_token_length(header.chunk_size, header.cipher))
+    # AEAD chunks don't store their index; it is part of the nonce and associated data.
+    items = ((index, token) for index, (token,) in enumerate(tokens))
+
+    index = 0
+    processed = 0
+    plaintext_size = 0
+    offsets = []
+    finished = False
+    for crypto_seconds, (token_length, chunk_index, flags, plaintext) in _map_chunks(
+            _chunk_decrypt_task(header), items, header.cipher, key, workers, cancel_event):
+        if finished:
+            raise EncryptionFormatError("Unexpected data after the final chunk.")
+        if chunk_index != index:
+            raise EncryptionFormatError(f"Chunk {index} is out of order.")
+        finished = bool(flags & _FLAG_FINAL)
+        if not finished and len(plaintext) != header.chunk_size:
+            raise EncryptionFormatError(f"Chunk {index} has the wrong size.")
+        destination.write(plaintext)
+        offsets.append(processed)
+        plaintext_size += len(plaintext)
+        processed += _CHUNK_LENGTH.size + token_length
+        instrument.chunk(crypto_seconds)
+        if progress is not None:
+            progress(processed)
+        index += 1
+
+    if not finished:
+        raise EncryptionFormatError("Encrypted file is truncated.")
+    if header.version >= 5:
+        expected = _build_index(offsets, plaintext_size)
+        if bytes(_read_exact(source, len(expected))) != expected:
+            raise EncryptionFormatError("The chunk index does not match the chunks.")
+    if source.read(1):
+        raise EncryptionFormatError("Unexpected data after the final chunk.")
+    instrument.finish(plaintext_size)
+
+
+def _read_index(file, chunk_start, file_size, header):
+    """
+    Returns the offsets of a file's chunks relative to `chunk_start`, and the
+    plaintext size recorded in the index (None for files without one).
+    """
+    if header.version >= 5:
+        if file_size - chunk_start < _INDEX_FOOTER.size:
+            raise EncryptionFormatError("Encrypted file is truncated.")
+        file.seek(file_size - _INDEX_FOOTER.size)
+        count, plaintext_size, magic = _INDEX_FOOTER.unpack(bytes(_read_exact(file, _INDEX_FOOTER.size)))
+        index_start = file_size - _INDEX_FOOTER.size - count * _INDEX_ENTRY.size
+        if magic != _INDEX_MAGIC or count < 1 or index_start < chunk_start:
+            raise EncryptionFormatError("The chunk index is missing or corrupted.")
+        file.seek(index_start)
+        entries = bytes(_read_exact(file, count * _INDEX_ENTRY.size))
+        offsets = [offset for (offset,) in _INDEX_ENTRY.iter_unpack(entries)]
+        if offsets[0] != 0 or any(b <= a for a, b in zip(offsets, offsets[1:])) \
+                or chunk_start + offsets[-1] >= index_start:
+            raise EncryptionFormatError("The chunk index is missing or corrupted.")
+        return offsets, plaintext_size
+
+    # Older files have no index: hop from one length prefix to the next.
+    max_token = _max_token_length(header.chunk_size, header.cipher)
+    offsets = []
+    position = chunk_start
+    while True:
+        if position == file_size and offsets and header.version == 1:
+            # Version 1 files written before the length prefix carried
+            # _LENGTH_FINAL_BIT just end. The final flag inside the last
+            # token is still authenticated, so truncation is caught when
+            # that chunk is decrypted.
+            return offsets, None
+        file.seek(position)
+        length_bytes = _read_exact(file, _CHUNK_LENGTH.size)
+        if len(length_bytes) < _CHUNK_LENGTH.size:
+            raise EncryptionFormatError("Encrypted file is truncated.")
+        (length_field,) = _CHUNK_LENGTH.unpack(length_bytes)
+        token_length = length_field & ~_LENGTH_FINAL_BIT
+        if token_length > max_token or position + _CHUNK_LENGTH.size + token_length > file_size:
+            raise EncryptionFormatError(f"Chunk {len(offsets)} is truncated or has an invalid length.")
+        offsets.append(position - chunk_start)
+        position += _CHUNK_LENGTH.size + token_length
+        if length_field & _LENGTH_FINAL_BIT:
+            return offsets, None
+
+
+class EncryptedFileReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over the plaintext of an encrypted file.
+
+    Only the chunks that cover a read are loaded and authenticated, so any
+    byte range of a large file is available without decrypting the rest.
+    The last decrypted chunk is kept, making small sequential reads cheap.
+    `file` is a path or a seekable binary file; `password` is the password
+    bytes or a KeyProvider. Files in the original whole-file format cannot
+    be read out of order and raise EncryptionFormatError.
+    """
+
+    def __init__(self, file, password):
+        super().__init__()
+        self._owns_file = False
+        self._position = 0
+        self._cached_index = None
+        self._cached_chunk = None
+        if isinstance(file, (str, bytes, os.PathLike)):
+            file = open(file, 'rb')
+            self._owns_file = True
+        self._file = file
+        try:
+            self._load(_as_key_provider(password))
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self, keys):
+        prefix = _read_exact(self._file, len(MAGIC))
+        if prefix != MAGIC:
+            raise EncryptionFormatError("Random access needs a chunked file; this one uses the "
+                                        "original whole-file format.")
+        self._header = _read_header(self._file, prefix)
+        self._cipher = _new_cipher(self._header.cipher, _file_key(keys, self._header))
+        self._decrypt = _chunk_decrypt_task(self._header)
+        self.chunk_size = self._header.chunk_size
+        self._chunk_start = self._file.tell()
+        file_size = self._file.seek(0, io.SEEK_END)
+        self._offsets, indexed_size = _read_index(self._file, self._chunk_start, file_size, self._header)
+        # Decrypting the last chunk authenticates the plaintext size.
+        last = len(self._offsets) - 1
+        self.size = last * self.chunk_size + len(self._load_chunk(last))
+        if indexed_size is not None and indexed_size != self.size:
+            raise EncryptionFormatError("The chunk index does not match the chunks.")
+
+    def _load_chunk(self, index):
+        if index == self._cached_index:
+            return self._cached_chunk
+        self._file.seek(self._chunk_start + self._offsets[index])
+        (length_field,) = _CHUNK_LENGTH.unpack(bytes(_read_exact(self._file, _CHUNK_LENGTH.size)))
+        token_length = length_field & ~_LENGTH_FINAL_BIT
+        if token_length > _max_token_length(self._header.chunk_size, self._header.cipher):
+            raise EncryptionFormatError(f"Chunk {index} has an invalid length.")
+        token = _read_exact(self._file, token_length)
+        if len(token) != token_length:
+            raise EncryptionFormatError("Encrypted file is truncated.")
+        _, chunk_index, flags, plaintext = self._decrypt(self._cipher, index, token)
+        final = index == len(self._offsets) - 1
+        if chunk_index != index or bool(flags & _FLAG_FINAL) != final \
+                or (not final and len(plaintext) != self.chunk_size):
+            raise EncryptionFormatError(f"Chunk {index} is corrupted or out of place.")
+        self._cached_index, self._cached_chunk = index, plaintext
+        return plaintext
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence: {whence}")
+        if offset < 0:
+            raise ValueError("Negative seek position.")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view) and self._position < self.size:
+            index, start = divmod(self._position, self.chunk_size)
+            chunk = self._load_chunk(index)
+            count = min(len(view) - filled, len(chunk) - start)
+            view[filled:filled + count] = chunk[start:start + count]
+            filled += count
+            self._position += count
+        return filled
+
+    def close(self):
+        if not self.closed:
+            self._cached_chunk = None
+            if self._owns_file:
+                self._file.close()
+        super().close()
+
+
+def decrypt_range(input_path, destination, password, offset: int, length: int = None,
+                  progress=None, cancel_event=None) -> int:
+    """
+    Writes `length` plaintext bytes starting at `offset` (to the end of the
+    file when `length` is None) to `destination`, reading and authenticating
+    only the chunks that cover the range. Returns the number of bytes written,
+    which is smaller than `length` when the range runs past the end.
+    """
+    with EncryptedFileReader(input_path, password) as reader:
+        reader.seek(offset)
+        remaining = max(0, reader.size - offset) if length is None else length
+        written = 0
+        while remaining > 0:
+            _check_cancelled(cancel_event)
+            data = reader.read(min(remaining, reader.chunk_size))
+            if not data:
+                break
+            destination.write(data)
+            written += len(data)
+            remaining -= len(data)
+            if progress is not None:
+                progress(written)
+    return written
+
+
+def process_file(mode, input_path, output_path, password, progress=None, cancel_event=None,
+                 workers: int = 1, fsync: str = DEFAULT_FSYNC, compression=None,
+                 cipher: str = DEFAULT_CIPHER, events=None):
+    """
+    Encrypts or decrypts one file (`compression` and `cipher` apply to
+    encryption only). The output is written atomically (see AtomicWriter), so
+    a failure leaves any existing `output_path` intact, and `output_path` may
+    even be the input file itself. Events carry the input file as "path".
+
+    Decryption reads the input through a memory map, so chunks are verified
+    and decrypted straight from the mapped file.
+    """
+    events = _with_fields(events, path=input_path)
+    # The source is closed before AtomicWriter renames over it: Windows refuses
+    # to replace a file that is still open.
+    with AtomicWriter(output_path, fsync) as destination:
+        with open(input_path, 'rb') as source:
+            workers = _workers_for(source, workers)
+            if mode == "encrypt":
+                encrypt_stream(source, destination, password, progress=progress,
+                               cancel_event=cancel_event, workers=workers, compression=compression,
+                               cipher=cipher, events=events)
+            else:
+                with _open_mapped(source) as mapped:
+                    decrypt_stream(mapped, destination, password, progress=progress,
+                                   cancel_event=cancel_event, workers=workers, events=events,
+                                   discarded_on_failure=True)
+
+
+class _DiscardWriter:
+    """Destination that drops everything written to it."""
+
+    def write(self, data):
+        return len(data)
+
+
+def verify_stream(source, password, progress=None, cancel_event=None, workers: int = 1, events=None):
+    """
+    Authenticates every chunk of `source` (and its chunk index) without
+    writing any plaintext. Raises like `decrypt_stream` if the password is
+    wrong or the file is corrupted, truncated or tampered with.
+    """
+    decrypt_stream(source, _DiscardWriter(), password, progress=progress,
+                   cancel_event=cancel_event, workers=workers,
+                   events=_with_fields(events, operation="verify"), discarded_on_failure=True)
+
+
+def verify_file(input_path, password, progress=None, cancel_event=None, workers: int = 1,
+                events=None):
+    """Verifies one encrypted file through a memory map; see verify_stream."""
+    events = _with_fields(events, path=input_path)
+    with open(input_path, 'rb') as source, _open_mapped(source) as mapped:
+        workers = _workers_for(source, workers)
+        verify_stream(mapped, password, progress=progress, cancel_event=cancel_event, workers=workers,
+                      events=events)
+
+
+def rotate_file(input_path, old_password, new_password, fsync: str = DEFAULT_FSYNC,
+                in_place: bool = False) -> bool:
+    """
+    Re-encrypts a file's data key for `new_password` without touching its
+    chunks. By default the new header and the unchanged chunks are written
+    to a new file that is renamed into place (see AtomicWriter), so a crash
+    leaves either the old or the new file. With `in_place` True the padded
+    header is overwritten instead, a single small write however large the
+    file is, but one that is not atomic: a crash during it can leave a
+    header that neither password opens. Headers that don't fit fall back to
+    the copy. Files from before the envelope format (version 6) have no
+    data key, so they are re-encrypted chunk by chunk through
+    EncryptedFileReader, again without writing plaintext to disk.
+
+    Returns True if the header was rewritten in place. Rotation does not
+    revoke a data key that was already exposed; re-encrypt the file for that.
+    """
+    old_keys = _as_key_provider(old_password)
+    new_keys = _as_key_provider(new_password)
+    with open(input_path, 'r+b') as file:
+        prefix = _read_exact(file, len(MAGIC))
+        if prefix != MAGIC:
+            raise EncryptionFormatError("This file uses the original whole-file format; decrypt it "
+                                        "and encrypt it again instead.")
+        header = _read_header(file, prefix)
+        chunk_start = file.tell()
+        if header.wrapped_key is not None:
+            master_key = old_keys.master_key(header.salt, header.kdf)
+            data_key = _unwrap_data_key(master_key, header.wrapped_key, header.file_salt,
+                                        _header_aad(header))
+            header_bytes = _encode_header(new_keys, new_keys.master_key(new_keys.salt, new_keys.kdf),
+                                          data_key, header.file_salt, header.chunk_size,
+                                          header.cipher, header.compression)
+            reserved = chunk_start - _PREAMBLE.size
+            if in_place and len(header_bytes.rstrip(b" ")) <= reserved:
+                file.seek(_PREAMBLE.size)
+                file.write(header_bytes.rstrip(b" ").ljust(reserved))
+                file.flush()
+                if fsync != "none":
+                    os.fsync(file.fileno())
+                return True
+
+    if header.wrapped_key is not None:
+        # As in process_file, the source closes before the rename.
+        with AtomicWriter(input_path, fsync) as destination:
+            destination.write(_PREAMBLE.pack(MAGIC, header.version, len(header_bytes)))
+            destination.write(header_bytes)
+            with open(input_path, 'rb') as source:
+                source.seek(chunk_start)
+                shutil.copyfileobj(source, destination, CHUNK_SIZE)
+    else:
+        with AtomicWriter(input_path, fsync) as destination:
+            with EncryptedFileReader(input_path, old_keys) as reader:
+                encrypt_stream(reader, destination, new_keys, chunk_size=header.chunk_size,
+                               compression=header.compression, cipher=header.cipher)
+    return False
+
+
+def output_path_for(input_path, mode):
+    """Returns the default output path for a file, matching the save dialogs."""
+    if mode == "encrypt":
+        return input_path + ENCRYPTED_SUFFIX
+    if input_path.endswith(ENCRYPTED_SUFFIX):
+        return input_path[:-len(ENCRYPTED_SUFFIX)] + DECRYPTED_SUFFIX
+    return input_path + DECRYPTED_SUFFIX
+
+
+def iter_batch_files(paths, mode):
+    """
+    Yields the input files of a batch. Directories are walked recursively and
+    contribute only the files relevant to `mode` (`.encrypted` files when
+    decrypting, verifying or rotating, everything else when encrypting).
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(ENCRYPTED_SUFFIX) == (mode != "encrypt"):
+                    yield os.path.join(root, name)
+
+
+BatchResult = namedtuple("BatchResult", "input_path output_path ok error size seconds")
+
+
+def run_batch(paths, password, mode, jobs: int = 4, workers: int = 1, on_result=None,
+              cancel_event=None, fsync: str = DEFAULT_FSYNC, compression=None,
+              cipher: str = DEFAULT_CIPHER, events=None, new_password=None, in_place: bool = False):
+    """
+    Encrypts, decrypts, verifies (`mode` "verify", see verify_file) or
+    rotates (`mode` "rotate" to `new_password`, see rotate_file) every file
+    under `paths` through a bounded job queue.
+
+    Up to `jobs` files are processed concurrently, and the key is derived once
+    for the whole batch. Files large enough to benefit are split across
+    `workers` processes. `on_result` is called with a BatchResult as each file
+    finishes; the full list is also returned.
+    """
+    keys = _as_key_provider(password)
+    if mode == "rotate":
+        if new_password is None:
+            raise ValueError("Rotating files needs a new password.")
+        new_keys = _as_key_provider(new_password)
+    results = []
+    # Bound the queue so walking a huge tree doesn't create every job up front.
+    slots = threading.BoundedSemaphore(jobs * 2)
+
+    def run_job(input_path):
+        output_path = output_path_for(input_path, mode) if mode in ("encrypt", "decrypt") else None
+        started = time.monotonic()
+        size = 0
+        try:
+            size = os.path.getsize(input_path)
+            if mode == "verify":
+                verify_file(input_path, keys, cancel_event=cancel_event, workers=workers,
+                            events=events)
+            elif mode == "rotate":
+                rotate_file(input_path, keys, new_keys, fsync=fsync, in_place=in_place)
+            else:
+                process_file(mode, input_path, output_path, keys,
+                             cancel_event=cancel_event, workers=workers, fsync=fsync,
+                             compression=compression, cipher=cipher, events=events)
+            result = BatchResult(input_path, output_path, True, "", size, time.monotonic() - started)
+        except Exception as e:
+            result = BatchResult(input_path, output_path, False, str(e) or type(e).__name__,
+                                 size, time.monotonic() - started)
+        finally:
+            slots.release()
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for input_path in iter_batch_files(paths, mode):
+            slots.acquire()
+            if cancel_event is not None and cancel_event.is_set():
+                slots.release()
+                break
+            executor.submit(run_job, input_path)
+    return results
+
+
+def format_size(num_bytes):
+    """Formats a byte count for status messages."""
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
+
+def remove_quietly(path):
+    """Deletes a temporary or incomplete file, ignoring errors."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Exit codes of the command line interface.
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_BAD_DATA = 3
+EXIT_CANCELLED = 130
+
+PASSWORD_ENV = "DATA_ENCRYPTER_PASSWORD"
+NEW_PASSWORD_ENV = "DATA_ENCRYPTER_NEW_PASSWORD"
+
+
+def read_password(args, new=False):
+    """
+    Reads the password from --password-file, the environment, or the terminal
+    (with `new`, the rotation target from the --new-password-* options).
+    """
+    password_file = args.new_password_file if new else args.password_file
+    password_env = args.new_password_env if new else args.password_env
+    default_env = NEW_PASSWORD_ENV if new else PASSWORD_ENV
+    if password_file:
+        with open(password_file, 'rb') as file:
+            password = file.readline().rstrip(b"\r\n")
+    elif password_env:
+        password = os.environb.get(password_env.encode(), b"")
+        if not password:
+            raise ValueError(f"Environment variable {password_env} is not set.")
+    elif os.environb.get(default_env.encode()):
+        password = os.environb[default_env.encode()]
+    elif new:
+        password = getpass.getpass("New password: ").encode('utf-8')
+        if password != getpass.getpass("Repeat new password: ").encode('utf-8'):
+            raise ValueError("The new passwords do not match.")
+    else:
+        password = getpass.getpass("Password: ").encode('utf-8')
+    if not password:
+        raise ValueError("Password must not be empty.")
+    return password
+
+
+def compression_from_args(args):
+    """Returns the compression settings selected on the command line, or None."""
+    if not args.compress:
+        return None
+    compression = {"codec": args.compress}
+    if args.compress_level is not None:
+        compression["level"] = args.compress_level
+    try:
+        return validate_compression(compression)
+    except EncryptionFormatError as e:
+        raise ValueError(str(e))
+
+
+class _ProgressPrinter:
+    """
+    CLI event subscriber: a live progress line while a single file runs, and
+    a timing summary (KDF, read, crypto, write) when each file finishes.
+    """
+
+    INTERVAL = 0.5
+
+    def __init__(self, live=True):
+        self.live = live
+        self._lock = threading.Lock()
+        self._started = {}
+        self._read = {}
+        self._last_print = 0.0
+
+    def __call__(self, name, fields):
+        path = fields.get("path", "-")
+        with self._lock:
+            if name == "start":
+                self._started[path], self._read[path] = time.perf_counter(), 0
+            elif name == "chunk":
+                self._read[path] += fields["bytes_read"]
+                now = time.perf_counter()
+                if self.live and now - self._last_print >= self.INTERVAL:
+                    self._last_print = now
+                    elapsed = now - self._started[path]
+                    rate = self._read[path] / elapsed if elapsed > 0 else 0
+                    print(f"\r{fields['operation']}: {format_size(self._read[path])} read "
+                          f"({format_size(rate)}/s)  ", end="", file=sys.stderr, flush=True)
+            elif name == "finish":
+                if self.live:
+                    print("\r", end="", file=sys.stderr)
+                print(f"{fields['operation']} {path}: {format_size(fields['plaintext_bytes'])} in "
+                      f"{fields['seconds']:.2f} s ({format_size(fields['throughput'])}/s); "
+                      f"kdf {fields['kdf_seconds']:.2f} s, read {fields['read_seconds']:.2f} s, "
+                      f"crypto {fields['crypto_seconds']:.2f} s, write {fields['write_seconds']:.2f} s",
+                      file=sys.stderr)
+
+
+def _run_single(args, password, events=None):
+    mode = args.command
+    compression = compression_from_args(args)
+    if args.input == "-":
+        if args.output is None:
+            raise ValueError("An output path (or '-') is required when reading from stdin.")
+        source_path = None
+    else:
+        source_path = args.input
+    output = args.output or output_path_for(args.input, mode)
+    if mode == "encrypt":
+        operation = functools.partial(encrypt_stream, compression=compression, cipher=args.cipher)
+    else:
+        operation = decrypt_stream
+
+    if source_path is not None and output != "-":
+        process_file(mode, source_path, output, password, workers=args.workers, fsync=args.fsync,
+                     compression=compression, cipher=args.cipher, events=events)
+        return EXIT_OK
+
+    source = sys.stdin.buffer if source_path is None else open(source_path, 'rb')
+    try:
+        if output == "-":
+            operation(source, sys.stdout.buffer, password, workers=args.workers, events=events)
+            sys.stdout.buffer.flush()
+        else:
+            with AtomicWriter(output, args.fsync) as destination:
+                if mode == "encrypt":
+                    operation(source, destination, password, workers=args.workers, events=events)
+                else:
+                    operation(source, destination, password, workers=args.workers, events=events,
+                              discarded_on_failure=True)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    return EXIT_OK
+
+
+def _run_batch(args, password, events=None):
+    def report(result):
+        if result.ok:
+            print(f"OK      {result.input_path}", file=sys.stderr)
+        else:
+            print(f"FAILED  {result.input_path}: {result.error}", file=sys.stderr)
+
+    results = run_batch(args.paths, password, args.mode, jobs=args.jobs,
+                        workers=args.workers, on_result=report, fsync=args.fsync,
+                        compression=compression_from_args(args), cipher=args.cipher, events=events)
+    failed = sum(1 for result in results if not result.ok)
+    print(f"{len(results) - failed} succeeded, {failed} failed.", file=sys.stderr)
+    return EXIT_OK if not failed else EXIT_ERROR
+
+
+def _run_range(args, password):
+    if args.offset < 0 or (args.length is not None and args.length < 0):
+        raise ValueError("--offset and --length must not be negative.")
+    if args.output == "-":
+        decrypt_range(args.input, sys.stdout.buffer, password, args.offset, args.length)
+        sys.stdout.buffer.flush()
+    else:
+        with AtomicWriter(args.output, args.fsync) as destination:
+            decrypt_range(args.input, destination, password, args.offset, args.length)
+    return EXIT_OK
+
+
+def _run_verify(args, password, events=None):
+    def report(result):
+        if result.ok:
+            # Per-file times include waiting for the shared key derivation, so
+            # only the overall throughput is reported.
+            print(f"OK      {result.input_path} ({format_size(result.size)})", file=sys.stderr)
+        else:
+            print(f"FAILED  {result.input_path}: {result.error}", file=sys.stderr)
+
+    started = time.monotonic()
+    results = run_batch(args.paths, password, "verify", jobs=args.jobs, workers=args.workers,
+                        on_result=report, events=events)
+    elapsed = time.monotonic() - started
+    failed = sum(1 for result in results if not result.ok)
+    total = sum(result.size for result in results)
+    rate = total / elapsed if elapsed > 0 else 0
+    print(f"{len(results) - failed} verified, {failed} failed; {format_size(total)} in {elapsed:.1f} s "
+          f"({format_size(rate)}/s).", file=sys.stderr)
+    return EXIT_OK if not failed else EXIT_BAD_DATA
+
+
+def _run_rotate(args, password):
+    new_password = KeyProvider(read_password(args, new=True), kdf=password.kdf)
+
+    def report(result):
+        if result.ok:
+            print(f"OK      {result.input_path}", file=sys.stderr)
+        else:
+            print(f"FAILED  {result.input_path}: {result.error}", file=sys.stderr)
+
+    results = run_batch(args.paths, password, "rotate", jobs=args.jobs, on_result=report,
+                        fsync=args.fsync, new_password=new_password, in_place=args.in_place)
+    failed = sum(1 for result in results if not result.ok)
+    print(f"{len(results) - failed} rotated, {failed} failed.", file=sys.stderr)
+    return EXIT_OK if not failed else EXIT_ERROR
+
+
+def _run_calibrate(args):
+    kdf = calibrate_kdf(args.kdf, args.target_ms / 1000)
+    started = time.perf_counter()
+    derive_key(b"calibration", os.urandom(SALT_SIZE), kdf)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(json.dumps(kdf))
+    print(f"Derivation takes about {elapsed_ms:.0f} ms on this machine.", file=sys.stderr)
+    if args.save:
+        save_kdf_settings(kdf)
+        print(f"Saved as the default for new files: {kdf_settings_path()}", file=sys.stderr)
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m crypto_engine",
+        description="Encrypt and decrypt files without starting the GUI.",
+    )
+    password_options = argparse.ArgumentParser(add_help=False)
+    password_group = password_options.add_mutually_exclusive_group()
+    password_group.add_argument("--password-file", metavar="PATH",
+                                help="read the password from the first line of PATH")
+    password_group.add_argument("--password-env", metavar="NAME",
+                                help=f"read the password from environment variable NAME "
+                                     f"(default: {PASSWORD_ENV}, else prompt)")
+    password_options.add_argument("--workers", type=int, default=1,
+                                  help="processes used to encrypt chunks in parallel (default: 1)")
+    password_options.add_argument("--kdf", choices=sorted(KDFS),
+                                  help="key derivation function for new files (default: the "
+                                       "calibrated settings, else pbkdf2-sha256)")
+    password_options.add_argument("--fsync", choices=FSYNC_POLICIES, default=DEFAULT_FSYNC,
+                                  help="durability of output files: 'file' syncs data before the "
+                                       "atomic rename, 'full' also syncs the directory "
+                                       "(default: %(default)s)")
+    password_options.add_argument("--progress", action="store_true",
+                                  help="show progress and a read/crypto/write timing breakdown")
+    password_options.add_argument("--metrics-log", metavar="PATH",
+                                  help="append every engine event as a JSON line to PATH")
+    password_options.add_argument("--cipher", choices=CIPHERS, default=DEFAULT_CIPHER,
+                                  help="format of new files: binary AEAD chunks, or base64 Fernet "
+                                       "tokens (default: %(default)s; decryption auto-detects)")
+    password_options.add_argument("--compress", choices=ALL_CODECS,
+                                  help="compress new files before encrypting them (default: off)")
+    password_options.add_argument("--compress-level", type=int, metavar="N",
+                                  help="compression level (default: the codec's own default)")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("encrypt", "decrypt"):
+        command = commands.add_parser(name, parents=[password_options], help=f"{name} one file or stream")
+        command.add_argument("input", help="input file, or '-' for stdin")
+        command.add_argument("-o", "--output",
+                             help=f"output file, or '-' for stdout (default: input + "
+                                  f"{ENCRYPTED_SUFFIX if name == 'encrypt' else DECRYPTED_SUFFIX})")
+
+    byte_range = commands.add_parser("range", parents=[password_options],
+                                     help="decrypt part of a file, reading only the chunks it needs")
+    byte_range.add_argument("input", help="encrypted file (must be seekable)")
+    byte_range.add_argument("--offset", type=int, default=0, help="first plaintext byte (default: 0)")
+    byte_range.add_argument("--length", type=int, help="number of bytes (default: to the end)")
+    byte_range.add_argument("-o", "--output", default="-", help="output file, or '-' for stdout (default)")
+
+    batch = commands.add_parser("batch", parents=[password_options],
+                                help="encrypt or decrypt files and folders recursively")
+    batch.add_argument("mode", choices=("encrypt", "decrypt"))
+    batch.add_argument("paths", nargs="+", help="files and/or directories")
+    batch.add_argument("--jobs", type=int, default=4, help="files processed concurrently (default: 4)")
+
+    verify = commands.add_parser("verify", parents=[password_options],
+                                 help="authenticate encrypted files without writing any plaintext")
+    verify.add_argument("paths", nargs="+", help="files and/or directories (.encrypted files are checked)")
+    verify.add_argument("--jobs", type=int, default=4, help="files verified concurrently (default: 4)")
+
+    rotate = commands.add_parser("rotate", parents=[password_options],
+                                 help="re-encrypt the keys of files for a new password without "
+                                      "decrypting their data")
+    rotate.add_argument("paths", nargs="+", help="files and/or directories (.encrypted files are rotated)")
+    rotate.add_argument("--jobs", type=int, default=8, help="files rotated concurrently (default: 8)")
+    new_password_group = rotate.add_mutually_exclusive_group()
+    new_password_group.add_argument("--new-password-file", metavar="PATH",
+                                    help="read the new password from the first line of PATH")
+    new_password_group.add_argument("--new-password-env", metavar="NAME",
+                                    help=f"read the new password from environment variable NAME "
+                                         f"(default: {NEW_PASSWORD_ENV}, else prompt)")
+    rotate.add_argument("--in-place", action="store_true",
+                        help="overwrite each file's header in place instead of writing the file anew "
+                             "and renaming it (no copy, but a crash mid-write can lose the file)")
+
+    calibrate = commands.add_parser("calibrate", help="pick KDF parameters for a target derive time")
+    calibrate.add_argument("--kdf", choices=sorted(KDFS), default="pbkdf2-sha256")
+    calibrate.add_argument("--target-ms", type=float, default=250,
+                           help="target key derivation time in milliseconds (default: 250)")
+    calibrate.add_argument("--save", action="store_true",
+                           help="use the result as the default KDF for new files")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "workers", 1) < 1 or getattr(args, "jobs", 1) < 1:
+        print("error: --workers and --jobs must be at least 1", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        if args.command == "calibrate":
+            return _run_calibrate(args)
+        password = KeyProvider(read_password(args), kdf=load_kdf_settings(args.kdf))
+        events = EventBus()
+        if args.progress:
+            events.subscribe(_ProgressPrinter(live=args.command in ("encrypt", "decrypt")))
+        if args.metrics_log:
+            metrics_log = events.subscribe(JsonMetricsLog(args.metrics_log))
+        try:
+            if args.command == "batch":
+                return _run_batch(args, password, events)
+            if args.command == "range":
+                return _run_range(args, password)
+            if args.command == "verify":
+                return _run_verify(args, password, events)
+            if args.command == "rotate":
+                return _run_rotate(args, password)
+            return _run_single(args, password, events)
+        finally:
+            if args.metrics_log:
+                metrics_log.close()
+    except KeyboardInterrupt:
+        return EXIT_CANCELLED
+    except (InvalidToken, EncryptionFormatError) as e:
+        print(f"error: wrong password or corrupted file ({str(e) or type(e).__name__})", file=sys.stderr)
+        return EXIT_BAD_DATA
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,178 @@
 import sys
 import os
+import threading
+import time
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton,
-    QLabel, QLineEdit, QFileDialog, QMessageBox, QHBoxLayout, QCheckBox, QSizePolicy
+    QLabel, QLineEdit, QFileDialog, QMessageBox, QHBoxLayout, QCheckBox, QSizePolicy,
+    QProgressBar, QSpinBox, QPlainTextEdit, QComboBox
 )
-from PyQt6.QtCore import Qt
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.backends import default_backend
-import base64
+from PyQt6.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal
+from crypto_engine import (
+    CODECS, DEFAULT_CIPHER, Argon2id, KeyCache, KeyProvider, OperationCancelled, calibrate_kdf, format_size,
+    iter_batch_files, load_kdf_settings, process_file, run_batch, save_kdf_settings, verify_file
+)
+
+
+class CryptoWorker(QObject):
+    """Runs one encrypt/decrypt job on a background thread."""
+
+    # bytes processed, total bytes, throughput (bytes/s), ETA (seconds)
+    progress = pyqtSignal('qint64', 'qint64', float, float)
+    succeeded = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+    PROGRESS_INTERVAL = 0.1
+
+    def __init__(self, mode, input_path, output_path, password, workers=1, compression=None,
+                 cipher=DEFAULT_CIPHER):
+        super().__init__()
+        self.mode = mode
+        self.input_path = input_path
+        self.output_path = output_path
+        self.password = password
+        self.workers = workers
+        self.compression = compression
+        self.cipher = cipher
+        self.total = os.path.getsize(input_path)
+        self.cancel_event = threading.Event()
+        self._started = None
+        self._last_emit = 0.0
+        self.metrics = None
+
+    def cancel(self):
+        """Requests cancellation; the job stops at the next chunk boundary."""
+        self.cancel_event.set()
+
+    def report_progress(self, processed):
+        now = time.monotonic()
+        if self._started is None:
+            # The first chunk marks the end of key derivation.
+            self._started = (now, processed)
+        if now - self._last_emit < self.PROGRESS_INTERVAL and processed < self.total:
+            return
+        self._last_emit = now
+        start_time, start_bytes = self._started
+        elapsed = now - start_time
+        throughput = (processed - start_bytes) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - processed) / throughput if throughput > 0 else -1.0
+        self.progress.emit(processed, self.total, throughput, eta)
+
+    def handle_event(self, name, fields):
+        """Engine event subscriber; keeps the final timing breakdown."""
+        if name == "finish":
+            self.metrics = fields
+
+    def timing_summary(self):
+        """Short 'throughput; KDF/read/crypto/write' text, or "" before the job finished."""
+        if not self.metrics:
+            return ""
+        m = self.metrics
+        return (f" ({format_size(m['throughput'])}/s; KDF {m['kdf_seconds']:.2f} s, "
+                f"read {m['read_seconds']:.2f} s, crypto {m['crypto_seconds']:.2f} s, "
+                f"write {m['write_seconds']:.2f} s)")
+
+    def run(self):
+        try:
+            if self.mode == "verify":
+                verify_file(self.input_path, self.password, progress=self.report_progress,
+                            cancel_event=self.cancel_event, workers=self.workers,
+                            events=self.handle_event)
+            else:
+                process_file(self.mode, self.input_path, self.output_path, self.password,
+                             progress=self.report_progress, cancel_event=self.cancel_event,
+                             workers=self.workers, compression=self.compression, cipher=self.cipher,
+                             events=self.handle_event)
+        except OperationCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e) or type(e).__name__)
+        else:
+            self.succeeded.emit(self.output_path)
+        finally:
+            self.finished.emit()
+
+
+class BatchWorker(QObject):
+    """Runs a batch of encrypt/decrypt jobs on a background thread."""
+
+    # input path, succeeded, error message
+    file_done = pyqtSignal(str, bool, str)
+    # files done, files in batch
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+
+    def __init__(self, mode, paths, password, jobs=4, workers=1, compression=None,
+                 cipher=DEFAULT_CIPHER):
+        super().__init__()
+        self.mode = mode
+        self.paths = paths
+        self.password = password
+        self.jobs = jobs
+        self.workers = workers
+        self.compression = compression
+        self.cipher = cipher
+        self.cancel_event = threading.Event()
+        self.total = 0
+        self.done = 0
+        self.results = []
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Stops queueing new files and cancels the ones in progress."""
+        self.cancel_event.set()
+
+    def report_result(self, result):
+        # Called from the batch's job threads.
+        with self._lock:
+            self.done += 1
+            done = self.done
+        self.file_done.emit(result.input_path, result.ok, result.error)
+        self.progress.emit(done, self.total)
+
+    def run(self):
+        try:
+            self.total = sum(1 for _ in iter_batch_files(self.paths, self.mode))
+            self.progress.emit(0, self.total)
+            started = time.monotonic()
+            self.results = run_batch(self.paths, self.password, self.mode, jobs=self.jobs,
+                                     workers=self.workers, on_result=self.report_result,
+                                     cancel_event=self.cancel_event, compression=self.compression,
+                                     cipher=self.cipher)
+            self.seconds = time.monotonic() - started
+        finally:
+            self.finished.emit()
+
+
+class CalibrationWorker(QObject):
+    """Benchmarks a KDF on a background thread and saves the chosen parameters."""
+
+    succeeded = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal()
+
+    TARGET_SECONDS = 0.25
+
+    def __init__(self, kdf_name):
+        super().__init__()
+        self.kdf_name = kdf_name
+
+    def cancel(self):
+        """Calibration takes a few seconds at most and is not interruptible."""
+
+    def run(self):
+        try:
+            kdf = calibrate_kdf(self.kdf_name, self.TARGET_SECONDS)
+            save_kdf_settings(kdf)
+        except Exception as e:
+            self.failed.emit(str(e) or type(e).__name__)
+        else:
+            self.succeeded.emit(kdf)
+        finally:
+            self.finished.emit()
 
 
 class MainWindow(QWidget):
@@ -39,6 +202,11 @@ class MainWindow(QWidget):
         self.show_password_checkbox = QCheckBox("Show Password")
         self.show_password_checkbox.stateChanged.connect(self.toggle_password_visibility)
         password_input_layout.addWidget(self.show_password_checkbox)
+
+        forget_keys_button = QPushButton("Forget Keys")
+        forget_keys_button.setToolTip("Wipe derived keys cached from previous operations.")
+        forget_keys_button.clicked.connect(self.forget_keys)
+        password_input_layout.addWidget(forget_keys_button)
         password_group_layout.addLayout(password_input_layout)
         main_layout.addLayout(password_group_layout)
 
@@ -46,7 +214,7 @@ class MainWindow(QWidget):
         file_selection_group_layout = QVBoxLayout()
         file_selection_group_layout.setSpacing(5)
 
-        file_label = QLabel("File to Encrypt/Decrypt:")
+        file_label = QLabel("File(s) or Folder to Encrypt/Decrypt:")
         file_label.setStyleSheet("font-weight: bold;")
         file_selection_group_layout.addWidget(file_label)
 
@@ -56,12 +224,71 @@ class MainWindow(QWidget):
         self.file_path_label.setStyleSheet("border: 1px solid #ccc; padding: 5px; border-radius: 5px;")
         file_path_layout.addWidget(self.file_path_label)
 
-        select_file_button = QPushButton("Select File...")
+        select_file_button = QPushButton("Select File(s)...")
         select_file_button.clicked.connect(self.select_file)
         file_path_layout.addWidget(select_file_button)
+
+        select_folder_button = QPushButton("Select Folder...")
+        select_folder_button.clicked.connect(self.select_folder)
+        file_path_layout.addWidget(select_folder_button)
         file_selection_group_layout.addLayout(file_path_layout)
         main_layout.addLayout(file_selection_group_layout)
 
+        workers_layout = QHBoxLayout()
+        workers_label = QLabel("Worker processes:")
+        workers_label.setStyleSheet("font-weight: bold;")
+        workers_layout.addWidget(workers_label)
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, os.cpu_count() or 1)
+        self.workers_input.setValue(os.cpu_count() or 1)
+        self.workers_input.setToolTip("Number of CPU cores used to encrypt/decrypt chunks in parallel.")
+        workers_layout.addWidget(self.workers_input)
+
+        kdf_label = QLabel("Key derivation:")
+        kdf_label.setStyleSheet("font-weight: bold;")
+        workers_layout.addWidget(kdf_label)
+        self.kdf_input = QComboBox()
+        self.kdf_input.addItem("PBKDF2-SHA256", "pbkdf2-sha256")
+        self.kdf_input.addItem("scrypt", "scrypt")
+        if Argon2id is not None:
+            self.kdf_input.addItem("Argon2id", "argon2id")
+        self.kdf_input.setCurrentIndex(max(0, self.kdf_input.findData(load_kdf_settings()["name"])))
+        self.kdf_input.setToolTip("Used for newly encrypted files. Decryption reads it from the file.")
+        workers_layout.addWidget(self.kdf_input)
+
+        calibrate_button = QPushButton("Calibrate")
+        calibrate_button.setToolTip("Benchmark this machine and tune the selected KDF to about 250 ms.")
+        calibrate_button.clicked.connect(self.calibrate_kdf_action)
+        workers_layout.addWidget(calibrate_button)
+        workers_layout.addStretch(1)
+        main_layout.addLayout(workers_layout)
+
+        format_layout = QHBoxLayout()
+        format_label = QLabel("File format:")
+        format_label.setStyleSheet("font-weight: bold;")
+        format_layout.addWidget(format_label)
+        self.cipher_input = QComboBox()
+        self.cipher_input.addItem("AES-256-GCM (binary)", "aes-256-gcm")
+        self.cipher_input.addItem("ChaCha20-Poly1305 (binary)", "chacha20-poly1305")
+        self.cipher_input.addItem("Fernet (base64, larger)", "fernet")
+        self.cipher_input.setToolTip("Used for newly encrypted files. Decryption detects the format "
+                                     "automatically, including files from older versions.")
+        format_layout.addWidget(self.cipher_input)
+
+        compression_label = QLabel("Compression:")
+        compression_label.setStyleSheet("font-weight: bold;")
+        format_layout.addWidget(compression_label)
+        self.compression_input = QComboBox()
+        self.compression_input.addItem("None", None)
+        for codec in ("zlib", "lzma", "zstd"):
+            if codec in CODECS:
+                self.compression_input.addItem(codec, codec)
+        self.compression_input.setToolTip("Compress files before encrypting them. Chunks that don't "
+                                          "compress (media, archives) are stored as they are.")
+        format_layout.addWidget(self.compression_input)
+        format_layout.addStretch(1)
+        main_layout.addLayout(format_layout)
+
 
      
         button_layout = QHBoxLayout()
@@ -69,6 +296,11 @@ class MainWindow(QWidget):
         encrypt_button.clicked.connect(self.encrypt_file_action)
         decrypt_button = QPushButton("Decrypt File")
         decrypt_button.clicked.connect(self.decrypt_file_action)
+        verify_button = QPushButton("Verify File")
+        verify_button.setToolTip("Check the password and the file's integrity without writing any plaintext.")
+        verify_button.clicked.connect(self.verify_file_action)
+        self.action_buttons = [select_file_button, select_folder_button, encrypt_button, decrypt_button,
+                               verify_button, calibrate_button]
 
 
         button_style = """
@@ -94,23 +326,53 @@ class MainWindow(QWidget):
 
         encrypt_button.setStyleSheet(button_style)
         decrypt_button.setStyleSheet(decrypt_button_style)
+        verify_button.setStyleSheet(button_style.replace("#4CAF50", "#7E57C2").replace("#45a049", "#6f4bb3").replace("#367c39", "#5a3a96"))
 
         button_layout.addStretch(1) 
         button_layout.addWidget(encrypt_button)
         button_layout.addWidget(decrypt_button)
+        button_layout.addWidget(verify_button)
         button_layout.addStretch(1) 
         main_layout.addLayout(button_layout)
 
        
+        progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setVisible(False)
+        progress_layout.addWidget(self.progress_bar)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_job)
+        self.cancel_button.setVisible(False)
+        progress_layout.addWidget(self.cancel_button)
+        main_layout.addLayout(progress_layout)
+
         self.status_label = QLabel("Ready. Please select a file and enter a password.")
         self.status_label.setStyleSheet("font-style: italic; color: #555;")
         main_layout.addWidget(self.status_label)
 
+        # Per-file results of batch runs.
+        self.batch_log = QPlainTextEdit()
+        self.batch_log.setReadOnly(True)
+        self.batch_log.setVisible(False)
+        main_layout.addWidget(self.batch_log)
+
         main_layout.addStretch(1)
 
         self.setLayout(main_layout)
 
         self.selected_file_path = None
+        self.batch_paths = []
+
+        # Derived keys are cached so repeat operations skip PBKDF2.
+        self.key_cache = KeyCache()
+        self.key_cache_timer = QTimer(self)
+        self.key_cache_timer.timeout.connect(self.key_cache.purge_expired)
+        self.key_cache_timer.start(60 * 1000)
+        self.worker_thread = None
+        self.worker = None
 
 
         self.setStyleSheet("""
@@ -141,32 +403,35 @@ class MainWindow(QWidget):
             self.password_input.setEchoMode(QLineEdit.EchoMode.Password)
 
     def select_file(self):
-        """Opens a file dialog to let the user select a file."""
+        """Opens a file dialog to let the user select one or more files."""
         file_dialog = QFileDialog(self)
-        file_dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
+        file_dialog.setFileMode(QFileDialog.FileMode.ExistingFiles)
         if file_dialog.exec():
             selected_files = file_dialog.selectedFiles()
-            if selected_files:
+            if len(selected_files) == 1:
                 self.selected_file_path = selected_files[0]
+                self.batch_paths = []
                 self.file_path_label.setText(f"Selected: {os.path.basename(self.selected_file_path)}")
                 self.status_label.setText("File selected. Enter password and choose action.")
+            elif selected_files:
+                self.selected_file_path = None
+                self.batch_paths = selected_files
+                self.file_path_label.setText(f"Selected: {len(selected_files)} files")
+                self.status_label.setText("Files selected. Enter password and choose action.")
             else:
                 self.selected_file_path = None
+                self.batch_paths = []
                 self.file_path_label.setText("No file selected.")
                 self.status_label.setText("Please select a file to continue.")
 
-    def derive_key_from_password(self, password: bytes, salt: bytes) -> bytes:
-        """
-        Derives a Fernet key from a password and salt using PBKDF2HMAC.
-        """
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32, 
-            salt=salt,
-            iterations=480000, 
-            backend=default_backend()
-        )
-        return base64.urlsafe_b64encode(kdf.derive(password))
+    def select_folder(self):
+        """Opens a directory dialog; every file inside it is processed as a batch."""
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if folder:
+            self.selected_file_path = None
+            self.batch_paths = [folder]
+            self.file_path_label.setText(f"Selected folder: {os.path.basename(folder) or folder}")
+            self.status_label.setText("Folder selected. Enter password and choose action.")
 
     def get_password(self):
         """Retrieves the password from the input field."""
@@ -174,10 +439,24 @@ class MainWindow(QWidget):
         if not password:
             self.show_message("Error", "Please enter a password.", QMessageBox.Icon.Warning)
             return None
-        return password.encode('utf-8')
+        kdf = load_kdf_settings(self.kdf_input.currentData())
+        return KeyProvider(password.encode('utf-8'), cache=self.key_cache, kdf=kdf)
+
+    def get_compression(self):
+        """Returns the compression settings for new files, or None."""
+        codec = self.compression_input.currentData()
+        return {"codec": codec} if codec else None
+
+    def forget_keys(self):
+        """Wipes every cached key so the next operation re-derives it."""
+        self.key_cache.wipe()
+        self.status_label.setText("Cached keys wiped.")
 
     def encrypt_file_action(self):
         """Handles the encryption process when the encrypt button is clicked."""
+        if self.batch_paths:
+            self.start_batch("encrypt")
+            return
         if not self.selected_file_path:
             self.show_message("No File Selected", "Please select a file to encrypt.", QMessageBox.Icon.Warning)
             return
@@ -186,11 +465,6 @@ class MainWindow(QWidget):
         if not password:
             return
 
-       
-        salt = os.urandom(16)
-        fernet_key = self.derive_key_from_password(password, salt)
-        fernet = Fernet(fernet_key)
-
       
         output_file_path, _ = QFileDialog.getSaveFileName(self, "Save Encrypted File As",
                                                         self.selected_file_path + ".encrypted",
@@ -208,29 +482,14 @@ class MainWindow(QWidget):
                 self.status_label.setText("Encryption cancelled to prevent overwrite.")
                 return
 
-        self.status_label.setText("Encrypting file... Please wait.")
-        QApplication.processEvents()
-
-        try:
-            with open(self.selected_file_path, 'rb') as file:
-                original_data = file.read()
-
-            encrypted_data = fernet.encrypt(original_data)
-
-            
-            final_data_to_write = salt + encrypted_data
-
-            with open(output_file_path, 'wb') as file:
-                file.write(final_data_to_write)
-
-            self.status_label.setText(f"File encrypted successfully: {os.path.basename(output_file_path)}")
-            self.show_message("Success", "File encrypted successfully! Remember your password!", QMessageBox.Icon.Information)
-        except Exception as e:
-            self.status_label.setText(f"Encryption failed: {e}")
-            self.show_message("Encryption Error", f"An error occurred during encryption: {e}", QMessageBox.Icon.Critical)
+        self.status_label.setText("Deriving key and encrypting file...")
+        self.start_job("encrypt", output_file_path, password)
 
     def decrypt_file_action(self):
         """Handles the decryption process when the decrypt button is clicked."""
+        if self.batch_paths:
+            self.start_batch("decrypt")
+            return
         if not self.selected_file_path:
             self.show_message("No File Selected", "Please select a file to decrypt.", QMessageBox.Icon.Warning)
             return
@@ -261,37 +520,218 @@ class MainWindow(QWidget):
                 self.status_label.setText("Decryption cancelled to prevent overwrite.")
                 return
 
-        self.status_label.setText("Decrypting file... Please wait.")
-        QApplication.processEvents() 
+        self.status_label.setText("Deriving key and decrypting file...")
+        self.start_job("decrypt", output_file_path, password)
 
-        try:
-            with open(self.selected_file_path, 'rb') as file:
-                full_encrypted_data = file.read()
-
-           
-            salt = full_encrypted_data[:16]
-            encrypted_data_without_salt = full_encrypted_data[16:]
+    def verify_file_action(self):
+        """Authenticates the selected file(s) without writing any plaintext."""
+        if self.batch_paths:
+            self.start_batch("verify")
+            return
+        if not self.selected_file_path:
+            self.show_message("No File Selected", "Please select a file to verify.", QMessageBox.Icon.Warning)
+            return
 
-            fernet_key = self.derive_key_from_password(password, salt)
-            fernet = Fernet(fernet_key)
+        password = self.get_password()
+        if not password:
+            return
 
-            decrypted_data = fernet.decrypt(encrypted_data_without_salt)
+        self.status_label.setText("Deriving key and verifying file...")
+        self.start_job("verify", "", password)
+
+    def start_job(self, mode, output_file_path, password):
+        """Runs an encrypt/decrypt job on a worker thread so the window stays responsive."""
+        self.worker_thread = QThread(self)
+        self.worker = CryptoWorker(mode, self.selected_file_path, output_file_path, password,
+                                   workers=self.workers_input.value(), compression=self.get_compression(),
+                                   cipher=self.cipher_input.currentData())
+        self.worker.moveToThread(self.worker_thread)
+
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.succeeded.connect(self.job_succeeded)
+        self.worker.failed.connect(self.job_failed)
+        self.worker.cancelled.connect(self.job_cancelled)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.job_finished)
+
+        self.set_busy(True)
+        self.worker_thread.start()
+
+    def start_batch(self, mode):
+        """Encrypts or decrypts every selected file/folder through the batch job queue."""
+        password = self.get_password()
+        if not password:
+            return
 
-            with open(output_file_path, 'wb') as file:
-                file.write(decrypted_data)
+        if mode != "verify":
+            reply = QMessageBox.question(self, 'Start Batch?',
+                                         f"Do you want to {mode} every selected file? Each output is written "
+                                         f"next to its source file and existing outputs will be overwritten.",
+                                         QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+            if reply == QMessageBox.StandardButton.No:
+                self.status_label.setText("Batch cancelled by user.")
+                return
 
-            self.status_label.setText(f"File decrypted successfully: {os.path.basename(output_file_path)}")
+        # Run a few files at once and let large files use the remaining cores.
+        cores = self.workers_input.value()
+        jobs = min(4, cores)
+        self.worker_thread = QThread(self)
+        self.worker = BatchWorker(mode, list(self.batch_paths), password,
+                                  jobs=jobs, workers=max(1, cores // jobs),
+                                  compression=self.get_compression(),
+                                  cipher=self.cipher_input.currentData())
+        self.worker.moveToThread(self.worker_thread)
+
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.update_batch_progress)
+        self.worker.file_done.connect(self.batch_file_done)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.batch_finished)
+
+        self.batch_log.clear()
+        self.batch_log.setVisible(True)
+        self.status_label.setText("Deriving key and scanning files...")
+        self.set_busy(True)
+        self.worker_thread.start()
+
+    def update_batch_progress(self, done, total):
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setValue(int(done * 1000 / total) if total else 1000)
+        action = {"encrypt": "Encrypting", "decrypt": "Decrypting", "verify": "Verifying"}[self.worker.mode]
+        self.status_label.setText(f"{action} batch... {done} of {total} files")
+
+    def batch_file_done(self, input_path, ok, error):
+        if ok:
+            self.batch_log.appendPlainText(f"OK      {input_path}")
+        else:
+            self.batch_log.appendPlainText(f"FAILED  {input_path}: {error}")
+
+    def batch_finished(self):
+        results = self.worker.results
+        failed = sum(1 for result in results if not result.ok)
+        cancelled = self.worker.cancel_event.is_set()
+        mode, seconds = self.worker.mode, self.worker.seconds
+        self.job_finished()
+
+        summary = f"Batch {'cancelled' if cancelled else 'complete'}: {len(results) - failed} succeeded, {failed} failed."
+        if mode == "verify" and seconds > 0:
+            total = sum(result.size for result in results)
+            summary += f" Verified {format_size(total)} at {format_size(total / seconds)}/s."
+        self.status_label.setText(summary)
+        icon = QMessageBox.Icon.Warning if failed or cancelled else QMessageBox.Icon.Information
+        self.show_message("Batch Finished", summary, icon)
+
+    def calibrate_kdf_action(self):
+        """Tunes the selected KDF for this machine on a worker thread."""
+        self.worker_thread = QThread(self)
+        self.worker = CalibrationWorker(self.kdf_input.currentData())
+        self.worker.moveToThread(self.worker_thread)
+
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.succeeded.connect(self.calibration_succeeded)
+        self.worker.failed.connect(self.calibration_failed)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.job_finished)
+
+        self.status_label.setText(f"Calibrating {self.kdf_input.currentText()}... Please wait.")
+        self.set_busy(True)
+        self.cancel_button.setVisible(False)
+        self.worker_thread.start()
+
+    def calibration_succeeded(self, kdf):
+        params = ", ".join(f"{name}={value}" for name, value in kdf.items() if name != "name")
+        self.status_label.setText(f"Calibrated {self.kdf_input.currentText()}: {params}. "
+                                  f"New files will use these settings.")
+
+    def calibration_failed(self, error):
+        self.status_label.setText(f"Calibration failed: {error}")
+        self.show_message("Calibration Error", f"Could not calibrate the KDF: {error}", QMessageBox.Icon.Critical)
+
+    def set_busy(self, busy):
+        """Toggles the controls between the idle and running states."""
+        for button in self.action_buttons:
+            button.setEnabled(not busy)
+        self.password_input.setEnabled(not busy)
+        self.workers_input.setEnabled(not busy)
+        self.kdf_input.setEnabled(not busy)
+        self.compression_input.setEnabled(not busy)
+        self.cipher_input.setEnabled(not busy)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setVisible(busy)
+        self.progress_bar.setVisible(busy)
+        if busy:
+            # Indeterminate until the first chunk finishes (key derivation).
+            self.progress_bar.setRange(0, 0)
+
+    def update_progress(self, processed, total, throughput, eta):
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setValue(int(processed * 1000 / total) if total else 1000)
+        action = {"encrypt": "Encrypting", "decrypt": "Decrypting", "verify": "Verifying"}[self.worker.mode]
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta >= 0 else "--:--:--"
+        self.status_label.setText(f"{action}... {format_size(processed)} of {format_size(total)} "
+                                  f"({format_size(throughput)}/s, ETA {eta_text})")
+
+    def cancel_job(self):
+        if self.worker is not None:
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText("Cancelling...")
+            self.worker.cancel()
+
+    def job_succeeded(self, output_file_path):
+        timing = self.worker.timing_summary()
+        if self.worker.mode == "verify":
+            self.status_label.setText(f"File verified: {os.path.basename(self.worker.input_path)}{timing}")
+            self.show_message("Verified", "The password is correct and the file is intact.",
+                              QMessageBox.Icon.Information)
+        elif self.worker.mode == "encrypt":
+            self.status_label.setText(f"File encrypted successfully: {os.path.basename(output_file_path)}{timing}")
+            self.show_message("Success", "File encrypted successfully! Remember your password!", QMessageBox.Icon.Information)
+        else:
+            self.status_label.setText(f"File decrypted successfully: {os.path.basename(output_file_path)}{timing}")
             self.show_message("Success", "File decrypted successfully!", QMessageBox.Icon.Information)
-        except Exception as e:
-           
-            self.status_label.setText(f"Decryption failed: {e}")
+
+    def job_failed(self, error):
+        if self.worker.mode == "encrypt":
+            self.status_label.setText(f"Encryption failed: {error}")
+            self.show_message("Encryption Error", f"An error occurred during encryption: {error}", QMessageBox.Icon.Critical)
+        elif self.worker.mode == "verify":
+            self.status_label.setText(f"Verification failed: {error}")
+            self.show_message("Verification Failed",
+                               f"The file could not be verified. This might be due to:\n"
+                               f"1. Incorrect password.\n"
+                               f"2. The file is not a valid encrypted file or is corrupted.\n"
+                               f"\nError details: {error}",
+                               QMessageBox.Icon.Critical)
+        else:
+            self.status_label.setText(f"Decryption failed: {error}")
             self.show_message("Decryption Error",
                                f"An error occurred during decryption. This might be due to:\n"
                                f"1. Incorrect password.\n"
                                f"2. The file is not a valid encrypted file or is corrupted.\n"
-                               f"\nError details: {e}",
+                               f"\nError details: {error}",
                                QMessageBox.Icon.Critical)
 
+    def job_cancelled(self):
+        action = {"encrypt": "Encryption", "decrypt": "Decryption", "verify": "Verification"}[self.worker.mode]
+        self.status_label.setText(f"{action} cancelled by user.")
+
+    def job_finished(self):
+        self.set_busy(False)
+        self.worker.deleteLater()
+        self.worker_thread.deleteLater()
+        self.worker = None
+        self.worker_thread = None
+
+    def closeEvent(self, event):
+        """Stops a running job and wipes cached keys before the window closes."""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+        self.key_cache.wipe()
+        super().closeEvent(event)
+
     def show_message(self, title, message, icon):
         """Helper function to display a QMessageBox."""
         msg_box = QMessageBox(self)
@@ -2,21 +2,28 @@ import sys
 import os
 import bcrypt
 import re
+import threading
 
 
 from random import randint
 from datetime import datetime, timedelta
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QTabWidget, QDialog, QLabel, QLineEdit,
     QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QFormLayout, QGroupBox,
     QTableWidget, QTableWidgetItem, QDateEdit, QComboBox, QTextEdit, QStatusBar,
     QHeaderView, QMessageBox, QStackedWidget, QToolBar,  QFileDialog, 
-    QCheckBox
+    QCheckBox, QTableView, QStyledItemDelegate, QStyle
+)
+from PyQt6.QtCore import (
+    Qt, QDate, QSize, QObject, QTimer, QRectF, pyqtSignal, QAbstractTableModel,
+    QModelIndex, QEvent
 )
-from PyQt6.QtCore import Qt, QDate, QSize
 from PyQt6.QtGui import (
     QIcon, QFont, QPalette, QColor, QPixmap, QImage, QBrush, 
-    QLinearGradient, QPainter,QAction
+    QLinearGradient, QPainter,QAction, QImageReader, QPixmapCache
 )
 
 # Global stylesheet for consistent text color
@@ -25,7 +32,7 @@ GLOBAL_STYLESHEET = """
         color: #000000;  /* Black text */
         font-family: 'Segoe UI', Arial;
     }
-    QTableWidget {
+    QTableView {
         background-color: #FFFFFF;  /* White background */
         gridline-color: #E0E0E0;
         font-size: 12px;
@@ -117,20 +124,88 @@ GLOBAL_STYLESHEET = """
 """
 
 # =====================
-# SECURITY & AUTH SYSTEM
+# DATABASE LAYER
 # =====================
 import sqlite3
 import json
 from pathlib import Path
 
+class Database:
+    """
+    Shared SQLite access for every hospital module.
+
+    Each thread keeps one long-lived connection (a connection must not be
+    used from two threads at once), so queries skip the connect/close cost.
+    Connections run in WAL mode, so readers never wait for a writer, and
+    repeated SQL text is served from sqlite3's prepared statement cache.
+    """
+    def __init__(self, path, cached_statements=256):
+        self.path = Path(path)
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+    
+    def connection(self):
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False only so close_all can run at shutdown.
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def transaction(self):
+        """Yields this thread's connection; commits on success, rolls back on error."""
+        conn = self.connection()
+        with conn:
+            yield conn
+    
+    def query_one(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+    
+    def query_all(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+    
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+# One database file shared by all modules
+database = Database('hospital_auth.db')
+
+# =====================
+# SECURITY & AUTH SYSTEM
+# =====================
+# Outcome of AuthSystem.authenticate. remaining_attempts is None for unknown users.
+AuthResult = namedtuple("AuthResult", "success role locked_out lockout_until remaining_attempts")
+
 class AuthSystem:
-    def __init__(self):
-        self.db_path = Path('hospital_auth.db')
+    MAX_FAILED_ATTEMPTS = 5
+    LOCKOUT_MINUTES = 30
+    # Number of previous passwords that can't be reused (and are kept)
+    PASSWORD_HISTORY_SIZE = 5
+    
+    def __init__(self, db):
+        self.db = db
+        self.db_path = db.path
         self.reset_tokens = {}
+        # Separate from AuthService's pool, which calls into this one
+        self.hash_pool = ThreadPoolExecutor(max_workers=self.PASSWORD_HISTORY_SIZE + 1,
+                                            thread_name_prefix="bcrypt")
         self.init_database()
     
     def init_database(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.db.transaction() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     username TEXT PRIMARY KEY,
@@ -152,14 +227,71 @@ class AuthSystem:
                     FOREIGN KEY (username) REFERENCES users(username)
                 )
             """)
-            conn.commit()
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_password_history_user_time
+                ON password_history (username, changed_at)
+            """)
+    
+    def close(self):
+        self.hash_pool.shutdown(wait=False, cancel_futures=True)
+    
+    def prune_password_history(self, username=None):
+        """
+        Retention job: deletes history beyond the newest PASSWORD_HISTORY_SIZE
+        entries, for one user or (username=None) for everyone.
+        """
+        with self.db.transaction() as conn:
+            if username is not None:
+                cursor = conn.execute("""
+                    DELETE FROM password_history
+                    WHERE username = ? AND rowid NOT IN (
+                        SELECT rowid FROM password_history WHERE username = ?
+                        ORDER BY changed_at DESC, rowid DESC LIMIT ?
+                    )
+                """, (username, username, self.PASSWORD_HISTORY_SIZE))
+            else:
+                cursor = conn.execute("""
+                    DELETE FROM password_history WHERE rowid IN (
+                        SELECT rowid FROM (
+                            SELECT rowid, ROW_NUMBER() OVER (
+                                PARTITION BY username ORDER BY changed_at DESC, rowid DESC
+                            ) AS position
+                            FROM password_history
+                        ) WHERE position > ?
+                    )
+                """, (self.PASSWORD_HISTORY_SIZE,))
+            return cursor.rowcount
+    
+    def is_recent_password(self, username, password):
+        """
+        Checks a password against the user's recent hashes. The bcrypt
+        comparisons run in parallel and the first match wins; comparisons
+        that haven't started yet are cancelled.
+        """
+        history = self.db.query_all("""
+            SELECT password_hash FROM password_history 
+            WHERE username = ? 
+            ORDER BY changed_at DESC, rowid DESC LIMIT ?
+        """, (username, self.PASSWORD_HISTORY_SIZE))
+        encoded = password.encode('utf-8')
+        futures = [self.hash_pool.submit(bcrypt.checkpw, encoded, old_hash) for (old_hash,) in history]
+        try:
+            for future in as_completed(futures):
+                if future.result():
+                    return True
+            return False
+        finally:
+            for future in futures:
+                future.cancel()
     
     def user_exists(self, username):
         """Checks if a user with the given username already exists in the database."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM users WHERE username = ?", (username,))
-            return cursor.fetchone() is not None
+        return self.db.query_one("SELECT 1 FROM users WHERE username = ?", (username,)) is not None
+    
+    def get_security_question(self, username):
+        """Returns the user's security question, or None if the user doesn't exist."""
+        result = self.db.query_one("SELECT security_question FROM users WHERE username = ?", (username,))
+        return result[0] if result else None
 
     def register_user(self, username, password, email, security_question, security_answer):
         if not self.validate_password_strength(password):
@@ -169,7 +301,7 @@ class AuthSystem:
             hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
             hashed_answer = bcrypt.hashpw(security_answer.lower().encode('utf-8'), bcrypt.gensalt())
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self.db.transaction() as conn:
                 conn.execute("""
                     INSERT INTO users 
                     (username, password_hash, email, security_question, security_answer, role, last_password_change)
@@ -182,84 +314,88 @@ class AuthSystem:
                     INSERT INTO password_history (username, password_hash, changed_at)
                     VALUES (?, ?, datetime('now'))
                 """, (username, hashed_pw))
-                conn.commit()
             return True, "User registered successfully"
         except sqlite3.IntegrityError:
             return False, "Username already exists"
             
     def verify_security_answer(self, username, answer):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT security_answer FROM users WHERE username = ?", (username,))
-            result = cursor.fetchone()
+        result = self.db.query_one("SELECT security_answer FROM users WHERE username = ?", (username,))
+        
+        if not result:
+            return False
             
-            if not result:
-                return False
-                
-            stored_answer_hash = result[0]
-            return bcrypt.checkpw(answer.lower().encode('utf-8'), stored_answer_hash)
+        stored_answer_hash = result[0]
+        return bcrypt.checkpw(answer.lower().encode('utf-8'), stored_answer_hash)
     
-    def verify_user(self, username, password):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT password_hash, failed_attempts, lockout_until 
-                FROM users WHERE username = ?
-            """, (username,))
-            result = cursor.fetchone()
+    def authenticate(self, username, password):
+        """
+        Checks a login with one SELECT and at most one UPDATE, returning an
+        AuthResult. bcrypt runs before any write lock is taken. Failures are
+        counted in SQL and the result is built from the committed count
+        (UPDATE ... RETURNING), so concurrent attempts each see their own.
+        """
+        result = self.db.query_one("""
+            SELECT password_hash, role, failed_attempts, lockout_until
+            FROM users WHERE username = ?
+        """, (username,))
+        
+        if not result:
+            return AuthResult(False, None, False, None, None)
             
-            if not result:
-                return False
-                
-            stored_hash, failed_attempts, lockout_until = result
-            
-            # Check account lockout
-            if lockout_until and datetime.fromisoformat(lockout_until) > datetime.now():
-                return False
-            
-            if bcrypt.checkpw(password.encode('utf-8'), stored_hash):
-                # Reset failed attempts on successful login
-                conn.execute("""
-                    UPDATE users 
-                    SET failed_attempts = 0, lockout_until = NULL 
-                    WHERE username = ?
-                """, (username,))
-                return True
-            else:
-                # Increment failed attempts
-                new_attempts = failed_attempts + 1
-                lockout_time = None
-                if new_attempts >= 5:
-                    lockout_time = (datetime.now() + timedelta(minutes=30)).isoformat()
-                
-                conn.execute("""
-                    UPDATE users 
-                    SET failed_attempts = ?, lockout_until = ? 
-                    WHERE username = ?
-                """, (new_attempts, lockout_time, username))
-                return False
+        stored_hash, role, failed_attempts, lockout_until = result
+        lockout_until = datetime.fromisoformat(lockout_until) if lockout_until else None
+        
+        # Check account lockout
+        if lockout_until and lockout_until > datetime.now():
+            return AuthResult(False, None, True, lockout_until, 0)
+        
+        if bcrypt.checkpw(password.encode('utf-8'), stored_hash):
+            # Reset failed attempts on successful login, if there are any
+            if failed_attempts or lockout_until:
+                with self.db.transaction() as conn:
+                    conn.execute("""
+                        UPDATE users 
+                        SET failed_attempts = 0, lockout_until = NULL 
+                        WHERE username = ?
+                    """, (username,))
+            return AuthResult(True, role, False, None, self.MAX_FAILED_ATTEMPTS)
+        
+        # Increment failed attempts, locking the account at the limit
+        lockout_time = datetime.now() + timedelta(minutes=self.LOCKOUT_MINUTES)
+        with self.db.transaction() as conn:
+            updated = conn.execute("""
+                UPDATE users 
+                SET failed_attempts = failed_attempts + 1,
+                    lockout_until = CASE WHEN failed_attempts + 1 >= ? THEN ? ELSE NULL END
+                WHERE username = ?
+                RETURNING failed_attempts, lockout_until
+            """, (self.MAX_FAILED_ATTEMPTS, lockout_time.isoformat(), username)).fetchone()
+        if updated is None:  # deleted since the SELECT
+            return AuthResult(False, None, False, None, None)
+        failed_attempts, lockout_until = updated
+        lockout_until = datetime.fromisoformat(lockout_until) if lockout_until else None
+        return AuthResult(False, None, lockout_until is not None, lockout_until,
+                          max(0, self.MAX_FAILED_ATTEMPTS - failed_attempts))
+    
+    def verify_user(self, username, password):
+        return self.authenticate(username, password).success
     
     def reset_password(self, username, new_password):
         if not self.validate_password_strength(new_password):
             return False, "Password does not meet security requirements"
             
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Check password history
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT password_hash FROM password_history 
-                    WHERE username = ? 
-                    ORDER BY changed_at DESC LIMIT 5
-                """, (username,))
-                
-                # Prevent reuse of last 5 passwords
-                for (old_hash,) in cursor.fetchall():
-                    if bcrypt.checkpw(new_password.encode('utf-8'), old_hash):
-                        return False, "Cannot reuse recent passwords"
-                
+            # Hash the new password while the history is being checked
+            hash_future = self.hash_pool.submit(bcrypt.hashpw, new_password.encode('utf-8'),
+                                                bcrypt.gensalt())
+            # Prevent reuse of recent passwords
+            if self.is_recent_password(username, new_password):
+                hash_future.cancel()
+                return False, "Cannot reuse recent passwords"
+            new_hash = hash_future.result()
+            
+            with self.db.transaction() as conn:
                 # Update password
-                new_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
                 conn.execute("""
                     UPDATE users 
                     SET password_hash = ?, last_password_change = datetime('now'),
@@ -272,14 +408,14 @@ class AuthSystem:
                     INSERT INTO password_history (username, password_hash, changed_at)
                     VALUES (?, ?, datetime('now'))
                 """, (username, new_hash))
-                
-                # Invalidate all reset tokens for this user
-                for token in list(self.reset_tokens.keys()):
-                    if self.reset_tokens[token]['username'] == username:
-                        self.reset_tokens[token]['used'] = True
-                        
-                conn.commit()
-                return True, "Password updated successfully"
+            self.prune_password_history(username)
+            
+            # Invalidate all reset tokens for this user
+            for token in list(self.reset_tokens.keys()):
+                if self.reset_tokens[token]['username'] == username:
+                    self.reset_tokens[token]['used'] = True
+                    
+            return True, "Password updated successfully"
         except Exception as e:
             return False, str(e)
     
@@ -297,7 +433,590 @@ class AuthSystem:
         return True
 
 # Initialize authentication system globally
-auth_system = AuthSystem()
+auth_system = AuthSystem(database)
+
+# =====================
+# ASYNC AUTH SERVICE
+# =====================
+class AuthRequest(QObject):
+    """One pending AuthService call; emits exactly one of its signals."""
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+class AuthService:
+    """
+    Runs AuthSystem calls on a thread pool so bcrypt never blocks the Qt
+    event loop. bcrypt releases the GIL, so concurrent logins and resets
+    from several desks run side by side instead of queueing.
+    """
+    def __init__(self, auth, max_workers=4):
+        self.auth = auth
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="auth")
+        self._pending = set()
+
+    def submit(self, method, *args, on_result=None, on_error=None):
+        """
+        Calls auth.<method>(*args) in the pool. `on_result` receives the return
+        value and `on_error` the error message, both on the GUI thread.
+        """
+        request = AuthRequest()
+        if on_result is not None:
+            request.finished.connect(on_result)
+        if on_error is not None:
+            request.failed.connect(on_error)
+        # Keep the request alive until its callbacks have run.
+        self._pending.add(request)
+        request.finished.connect(lambda _: self._pending.discard(request))
+        request.failed.connect(lambda _: self._pending.discard(request))
+        future = self.executor.submit(getattr(self.auth, method), *args)
+        future.add_done_callback(lambda f: self._deliver(request, f))
+        return request
+
+    def _deliver(self, request, future):
+        # Runs on the worker thread; the signals are queued to the GUI thread.
+        error = future.exception()
+        if error is not None:
+            request.failed.emit(str(error) or type(error).__name__)
+        else:
+            request.finished.emit(future.result())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+auth_service = AuthService(auth_system)
+
+# =====================
+# PATIENT REPOSITORY
+# =====================
+# Column order of every patient row returned by PatientRepository
+PATIENT_FIELDS = ("patient_id", "name", "age", "gender", "contact", "cnic", "diagnosis",
+                  "admit_date", "room", "doctor", "photo_path")
+
+class PatientRepository:
+    """
+    Persistent patient records. IDs, names and CNICs are NOCASE columns with
+    indexes, so exact and prefix lookups stay index searches however many
+    patients are stored. Free-text search goes through an FTS5 index over
+    ID, name, CNIC, contact and diagnosis that triggers keep in sync.
+    """
+    # bm25 weights for patient_id, name, cnic, contact, diagnosis
+    SEARCH_WEIGHTS = (5.0, 10.0, 5.0, 2.0, 1.0)
+    # PRAGMA user_version once the patients table has the schema below
+    SCHEMA_VERSION = 1
+    
+    def __init__(self, db):
+        self.db = db
+        self.init_database()
+    
+    def init_database(self):
+        with self.db.transaction() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self.migrate(conn)
+            self.create_table(conn, "patients")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_cnic ON patients (cnic)")
+            # Also orders the patient grid (see page). A missing admit date
+            # sorts as '' so the keyset seek still reaches it. Databases from
+            # before this index have a single-column one that it replaces.
+            conn.execute("DROP INDEX IF EXISTS idx_patients_admit_date")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_patients_admit_order
+                ON patients (COALESCE(admit_date, ''), patient_id)
+            """)
+            self.init_search_index(conn)
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    def create_table(self, conn, table):
+        # The explicit id keeps rowids stable across VACUUM, which the
+        # external-content search index relies on.
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                patient_id TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                name TEXT NOT NULL COLLATE NOCASE,
+                age INTEGER,
+                gender TEXT,
+                contact TEXT,
+                cnic TEXT NOT NULL COLLATE NOCASE,
+                diagnosis TEXT,
+                admit_date TEXT,
+                room TEXT,
+                doctor TEXT,
+                photo_path TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+    def migrate(self, conn):
+        """
+        Rebuilds a patients table keyed on patient_id (schema version 0) with
+        an explicit id, then drops the search index so it is rebuilt against
+        the new rowids. Runs inside init_database's transaction.
+        """
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(patients)")]
+        if not columns or "id" in columns:
+            return
+        copied = ", ".join(PATIENT_FIELDS + ("created_at",))
+        conn.execute("DROP TABLE IF EXISTS patients_rebuild")  # left by an interrupted attempt
+        self.create_table(conn, "patients_rebuild")
+        conn.execute(f"INSERT INTO patients_rebuild ({copied}) SELECT {copied} FROM patients ORDER BY rowid")
+        conn.execute("DROP TABLE IF EXISTS patients_fts_vocab")
+        conn.execute("DROP TABLE IF EXISTS patients_fts")
+        conn.execute("DROP TABLE patients")
+        conn.execute("ALTER TABLE patients_rebuild RENAME TO patients")
+    
+    def init_search_index(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'patients_fts'").fetchone() is not None
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                patient_id, name, cnic, contact, diagnosis,
+                content='patients', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+        # Every indexed term, for typo-tolerant matching (see search)
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts_vocab USING fts5vocab(patients_fts, 'row')")
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+                INSERT INTO patients_fts (rowid, patient_id, name, cnic, contact, diagnosis)
+                VALUES (new.rowid, new.patient_id, new.name, new.cnic, new.contact, new.diagnosis);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+                INSERT INTO patients_fts (patients_fts, rowid, patient_id, name, cnic, contact, diagnosis)
+                VALUES ('delete', old.rowid, old.patient_id, old.name, old.cnic, old.contact, old.diagnosis);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS patients_fts_update AFTER UPDATE ON patients BEGIN
+                INSERT INTO patients_fts (patients_fts, rowid, patient_id, name, cnic, contact, diagnosis)
+                VALUES ('delete', old.rowid, old.patient_id, old.name, old.cnic, old.contact, old.diagnosis);
+                INSERT INTO patients_fts (rowid, patient_id, name, cnic, contact, diagnosis)
+                VALUES (new.rowid, new.patient_id, new.name, new.cnic, new.contact, new.diagnosis);
+            END
+        """)
+        if not exists:
+            # Index patients stored before search existed
+            conn.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+    
+    def add(self, patient):
+        """Inserts a patient dict (keys from PATIENT_FIELDS); False if the ID is taken."""
+        values = [patient.get(field) for field in PATIENT_FIELDS]
+        try:
+            with self.db.transaction() as conn:
+                conn.execute(f"""
+                    INSERT INTO patients ({", ".join(PATIENT_FIELDS)})
+                    VALUES ({", ".join("?" * len(PATIENT_FIELDS))})
+                """, values)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+    
+    def get(self, patient_id):
+        """Returns the patient as a dict, or None."""
+        row = self.db.query_one(f"SELECT {', '.join(PATIENT_FIELDS)} FROM patients WHERE patient_id = ?",
+                                (patient_id,))
+        return dict(zip(PATIENT_FIELDS, row)) if row else None
+    
+    def update(self, patient_id, **fields):
+        """Updates the given fields of a patient; False if there is no such patient."""
+        unknown = set(fields) - set(PATIENT_FIELDS[1:])
+        if unknown:
+            raise ValueError(f"Unknown patient fields: {', '.join(sorted(unknown))}")
+        if not fields:
+            return self.get(patient_id) is not None
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self.db.transaction() as conn:
+            cursor = conn.execute(f"UPDATE patients SET {assignments} WHERE patient_id = ?",
+                                  [*fields.values(), patient_id])
+        return cursor.rowcount > 0
+    
+    def delete(self, patient_id):
+        with self.db.transaction() as conn:
+            cursor = conn.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
+        return cursor.rowcount > 0
+    
+    def count(self):
+        return self.db.query_one("SELECT COUNT(*) FROM patients")[0]
+    
+    def page(self, limit=200, after=None):
+        """
+        The next `limit` patients, most recently admitted first. `after` is the
+        last row of the previous page; paging by key instead of OFFSET keeps
+        deep pages as fast as the first.
+        """
+        if after is None:
+            return self.db.query_all(f"""
+                SELECT {", ".join(PATIENT_FIELDS)} FROM patients
+                ORDER BY COALESCE(admit_date, '') DESC, patient_id DESC LIMIT ?
+            """, (limit,))
+        return self.db.query_all(f"""
+            SELECT {", ".join(PATIENT_FIELDS)} FROM patients
+            WHERE COALESCE(admit_date, '') <= ?1
+              AND (COALESCE(admit_date, '') < ?1 OR patient_id < ?2)
+            ORDER BY COALESCE(admit_date, '') DESC, patient_id DESC LIMIT ?3
+        """, (after[7] or "", after[0], limit))
+    
+    def admitted_between(self, start, end, limit=1000):
+        """Patients admitted from `start` to `end` (ISO dates, inclusive)."""
+        return self.db.query_all(f"""
+            SELECT {", ".join(PATIENT_FIELDS)} FROM patients
+            WHERE COALESCE(admit_date, '') BETWEEN ? AND ?
+            ORDER BY COALESCE(admit_date, '') LIMIT ?
+        """, (start, end, limit))
+    
+    def search(self, text, limit=50):
+        """
+        Ranked full-text search. Every word of `text` must match the start of
+        a word in the ID, name, CNIC, contact or diagnosis. If that finds
+        fewer than `limit` patients, words are also allowed to be one typo
+        away from an indexed word, and those matches are ranked after.
+        """
+        terms = re.findall(r"\w+", text.lower())
+        if not terms:
+            return []
+        rows = self._match(" ".join(f'"{term}"*' for term in terms), limit)
+        if len(rows) < limit:
+            variants = [self._similar_terms(term) for term in terms]
+            if any(variants):
+                query = " AND ".join(
+                    "(" + " OR ".join([f'"{term}"*'] + [f'"{v}"' for v in similar]) + ")"
+                    for term, similar in zip(terms, variants))
+                seen = {row[0] for row in rows}
+                rows += [row for row in self._match(query, limit) if row[0] not in seen][:limit - len(rows)]
+        return rows
+    
+    def _match(self, query, limit):
+        return self.db.query_all(f"""
+            SELECT {", ".join("p." + field for field in PATIENT_FIELDS)}
+            FROM patients_fts JOIN patients p ON p.rowid = patients_fts.rowid
+            WHERE patients_fts MATCH ?
+            ORDER BY bm25(patients_fts, {", ".join(map(str, self.SEARCH_WEIGHTS))})
+            LIMIT ?
+        """, (query, limit))
+    
+    def _similar_terms(self, term):
+        """Indexed words one edit away from `term` (only for words of 4+ letters)."""
+        if len(term) < 4 or not term.isalpha():
+            return []
+        # Only words whose first two letters survive a typo in the first three
+        # are compared, which keeps the vocabulary scan tiny
+        candidates = []
+        for start in {term[:2], term[1] + term[0], term[0] + term[2]}:
+            candidates += self.db.query_all("""
+                SELECT term FROM patients_fts_vocab WHERE term >= ? AND term < ?
+            """, (start, start + "\uffff"))
+        return [candidate for (candidate,) in candidates
+                if candidate != term and abs(len(candidate) - len(term)) <= 1
+                and edit_distance(term, candidate) <= 1]
+
+def edit_distance(a, b):
+    """Levenshtein distance, counting a swap of adjacent letters as one edit."""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+patient_repository = PatientRepository(database)
+
+class PatientSearcher(QObject):
+    """
+    Runs patient searches on a background thread. Only the newest search
+    matters: starting one cancels the queued search and interrupts the
+    running query, and `results` carries a generation number so callers
+    can drop anything older than `generation`.
+    """
+    results = pyqtSignal(int, list)
+    failed = pyqtSignal(int, str)
+    
+    def __init__(self, repository):
+        super().__init__()
+        self.repository = repository
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._future = None
+        self._connection = None
+    
+    def search(self, text):
+        with self._lock:
+            self._cancel()
+            self._future = self.executor.submit(self._run, self.generation, text)
+    
+    def cancel(self):
+        with self._lock:
+            self._cancel()
+    
+    def _cancel(self):
+        self.generation += 1
+        if self._future is not None:
+            self._future.cancel()
+        if self._connection is not None:
+            # Makes the running statement fail with "interrupted"
+            self._connection.interrupt()
+    
+    def _run(self, generation, text):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._connection = self.repository.db.connection()
+        try:
+            rows = self.repository.search(text)
+        except sqlite3.Error as e:
+            if generation == self.generation:
+                self.failed.emit(generation, str(e))
+            return
+        finally:
+            with self._lock:
+                self._connection = None
+        if generation == self.generation:
+            self.results.emit(generation, rows)
+
+# =====================
+# PHOTO STORE
+# =====================
+import hashlib
+import tempfile
+
+class PhotoStore(QObject):
+    """
+    Content-addressed storage for patient photos. Imported files are copied
+    under `root` and named by their SHA-256, so an image uploaded twice or
+    shared by several patients is stored once and a stored path never
+    changes content.
+    
+    Thumbnails are decoded and downscaled on worker threads, then kept as
+    pixmaps in QPixmapCache (an LRU cache), so lists and detail views never
+    decode a full-resolution photo on the UI thread.
+    """
+    THUMBNAIL_SIZE = 200
+    CACHE_LIMIT_KB = 32 * 1024
+    _loaded = pyqtSignal(str, QImage)
+    
+    def __init__(self, root):
+        super().__init__()
+        self.root = Path(root)
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbnail")
+        self._waiting = {}    # cache key -> callbacks, while the thumbnail is loading
+        self._missing = set() # cache keys of images that could not be read
+        self._loaded.connect(self._store)
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), self.CACHE_LIMIT_KB))
+    
+    def import_file(self, source):
+        """Copies `source` into the store (once per content) and returns its stored path."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        # Hash while copying, so the source is read only once
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+                for block in iter(lambda: src.read(1024 * 1024), b""):
+                    digest.update(block)
+                    dst.write(block)
+            name = digest.hexdigest()
+            target = self.root / name[:2] / name
+            if target.exists():
+                os.remove(temp_path)
+            else:
+                target.parent.mkdir(exist_ok=True)
+                os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return str(target)
+    
+    def thumbnail(self, path, size=THUMBNAIL_SIZE, callback=None):
+        """
+        Returns the cached thumbnail of `path` (at most `size` pixels wide and
+        high), or None. On a miss the image is loaded on a worker thread and,
+        if it can be read, callback(pixmap) is called on the GUI thread.
+        """
+        key = f"{size}:{path}"
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None or key in self._missing:
+            return pixmap
+        if key not in self._waiting:
+            self._waiting[key] = []
+            self.executor.submit(self._load, key, path, size)
+        if callback is not None and callback not in self._waiting[key]:
+            self._waiting[key].append(callback)
+        return None
+    
+    def _load(self, key, path, size):
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        # Decoding straight to the target size lets JPEG skip most of the work
+        full_size = reader.size()
+        if full_size.isValid() and (full_size.width() > size or full_size.height() > size):
+            reader.setScaledSize(full_size.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull() and (image.width() > size or image.height() > size):
+            image = image.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        self._loaded.emit(key, image)
+    
+    def _store(self, key, image):
+        # Runs on the GUI thread: QPixmap must not be created anywhere else
+        callbacks = self._waiting.pop(key, [])
+        if image.isNull():
+            self._missing.add(key)
+            return
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(key, pixmap)
+        for callback in callbacks:
+            callback(pixmap)
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+photo_store = PhotoStore('patient_photos')
+
+# =====================
+# BILLING LEDGER
+# =====================
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENT = Decimal("0.01")
+
+# Running totals of one admission, as Decimals
+Bill = namedtuple("Bill", "subtotal tax total charge_count payment_status insurance")
+Charge = namedtuple("Charge", "charge_id charge_date service quantity unit_price amount")
+
+def to_cents(amount):
+    """Converts a Decimal with at most two decimal places to integer cents."""
+    if amount != amount.quantize(CENT):
+        raise ValueError(f"{amount} has more than two decimal places")
+    return int(amount * 100)
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+class BillingLedger:
+    """
+    Persistent charges per admission (patient ID + admit date). Amounts are
+    stored as integer cents, so sums are exact. Each admission's subtotal
+    is kept in `bills` and adjusted in the same transaction as every charge
+    added or removed, so opening a bill never rescans its charges; tax and
+    total are derived from the subtotal.
+    """
+    TAX_RATE = Decimal("0.10")
+    
+    def __init__(self, db):
+        self.db = db
+        self.init_database()
+    
+    def init_database(self):
+        with self.db.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS charges (
+                    id INTEGER PRIMARY KEY,
+                    patient_id TEXT NOT NULL COLLATE NOCASE,
+                    admit_date TEXT NOT NULL,
+                    charge_date TEXT NOT NULL,
+                    service TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    unit_price_cents INTEGER NOT NULL,
+                    amount_cents INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_charges_admission_date
+                ON charges (patient_id, admit_date, charge_date)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bills (
+                    patient_id TEXT NOT NULL COLLATE NOCASE,
+                    admit_date TEXT NOT NULL,
+                    subtotal_cents INTEGER NOT NULL DEFAULT 0,
+                    charge_count INTEGER NOT NULL DEFAULT 0,
+                    payment_status TEXT NOT NULL DEFAULT 'Unpaid',
+                    insurance TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (patient_id, admit_date)
+                )
+            """)
+    
+    def add_charge(self, patient_id, admit_date, charge_date, service, quantity, unit_price):
+        """Records a charge and returns (the new Charge, the updated Bill)."""
+        unit_cents = to_cents(unit_price)
+        amount_cents = quantity * unit_cents
+        with self.db.transaction() as conn:
+            charge_id = conn.execute("""
+                INSERT INTO charges (patient_id, admit_date, charge_date, service,
+                                     quantity, unit_price_cents, amount_cents)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (patient_id, admit_date, charge_date, service, quantity,
+                  unit_cents, amount_cents)).lastrowid
+            conn.execute("""
+                INSERT INTO bills (patient_id, admit_date, subtotal_cents, charge_count)
+                VALUES (?, ?, ?, 1)
+                ON CONFLICT (patient_id, admit_date) DO UPDATE SET
+                    subtotal_cents = subtotal_cents + excluded.subtotal_cents,
+                    charge_count = charge_count + 1
+            """, (patient_id, admit_date, amount_cents))
+        charge = Charge(charge_id, charge_date, service, quantity,
+                        from_cents(unit_cents), from_cents(amount_cents))
+        return charge, self.bill(patient_id, admit_date)
+    
+    def remove_charge(self, charge_id):
+        """Deletes a charge and takes it off its bill; returns False if it is gone."""
+        with self.db.transaction() as conn:
+            row = conn.execute("""
+                SELECT patient_id, admit_date, amount_cents FROM charges WHERE id = ?
+            """, (charge_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM charges WHERE id = ?", (charge_id,))
+            conn.execute("""
+                UPDATE bills SET subtotal_cents = subtotal_cents - ?, charge_count = charge_count - 1
+                WHERE patient_id = ? AND admit_date = ?
+            """, (row[2], row[0], row[1]))
+        return True
+    
+    def bill(self, patient_id, admit_date):
+        row = self.db.query_one("""
+            SELECT subtotal_cents, charge_count, payment_status, insurance FROM bills
+            WHERE patient_id = ? AND admit_date = ?
+        """, (patient_id, admit_date))
+        subtotal_cents, count, status, insurance = row or (0, 0, "Unpaid", "")
+        subtotal = from_cents(subtotal_cents)
+        tax = (subtotal * self.TAX_RATE).quantize(CENT, rounding=ROUND_HALF_UP)
+        return Bill(subtotal, tax, subtotal + tax, count, status, insurance)
+    
+    def charges(self, patient_id, admit_date, limit=-1, after=None):
+        """
+        The admission's charges, oldest first. Pass the last Charge of the
+        previous page as `after` to get the next one (keyset paging).
+        """
+        after_date, after_id = (after.charge_date, after.charge_id) if after else ("", 0)
+        rows = self.db.query_all("""
+            SELECT id, charge_date, service, quantity, unit_price_cents, amount_cents
+            FROM charges WHERE patient_id = ? AND admit_date = ? AND (charge_date, id) > (?, ?)
+            ORDER BY charge_date, id
+            LIMIT ?
+        """, (patient_id, admit_date, after_date, after_id, limit))
+        return [Charge(charge_id, date, service, quantity, from_cents(unit), from_cents(amount))
+                for charge_id, date, service, quantity, unit, amount in rows]
+    
+    def set_payment(self, patient_id, admit_date, payment_status, insurance):
+        with self.db.transaction() as conn:
+            conn.execute("""
+                INSERT INTO bills (patient_id, admit_date, payment_status, insurance)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (patient_id, admit_date) DO UPDATE SET
+                    payment_status = excluded.payment_status,
+                    insurance = excluded.insurance
+            """, (patient_id, admit_date, payment_status, insurance))
+
+billing_ledger = BillingLedger(database)
 
 # =====================
 # EMAIL SERVICE
@@ -331,6 +1050,40 @@ class GradientHeader(QLabel):
         painter.setPen(QColor(255, 255, 255))
         painter.drawText(event.rect(), Qt.AlignmentFlag.AlignCenter, self.text())
 
+class Spinner(QWidget):
+    """Small rotating arc shown while a background request is running."""
+    def __init__(self, size=24):
+        super().__init__()
+        self.setFixedSize(size, size)
+        self.angle = 0
+        self.timer = QTimer(self)
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.rotate)
+        self.hide()
+
+    def start(self):
+        self.show()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.hide()
+
+    def rotate(self):
+        self.angle = (self.angle + 30) % 360
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        pen = painter.pen()
+        pen.setColor(QColor("#2A82DA"))
+        pen.setWidth(3)
+        painter.setPen(pen)
+        rect = QRectF(3, 3, self.width() - 6, self.height() - 6)
+        # Qt angles are in 1/16th of a degree, counter-clockwise.
+        painter.drawArc(rect, -self.angle * 16, 270 * 16)
+
 class LoginDialog(QDialog):
     def __init__(self):
         super().__init__()
@@ -370,25 +1123,38 @@ class LoginDialog(QDialog):
         
         # Buttons
         btn_layout = QHBoxLayout()
-        login_btn = QPushButton("Login")
-        login_btn.clicked.connect(self.attempt_login)
-        forgot_btn = QPushButton("Forgot Password?")
-        forgot_btn.setStyleSheet("background-color: #E0E0E0; color: #2A82DA;")
-        forgot_btn.clicked.connect(self.show_forgot_password)
+        self.login_btn = QPushButton("Login")
+        self.login_btn.clicked.connect(self.attempt_login)
+        self.forgot_btn = QPushButton("Forgot Password?")
+        self.forgot_btn.setStyleSheet("background-color: #E0E0E0; color: #2A82DA;")
+        self.forgot_btn.clicked.connect(self.show_forgot_password)
         
-        btn_layout.addWidget(forgot_btn)
-        btn_layout.addWidget(login_btn)
+        btn_layout.addWidget(self.forgot_btn)
+        btn_layout.addWidget(self.login_btn)
         
         layout.addLayout(form_layout)
         layout.addLayout(btn_layout)
         
-        # Status label
+        # Status label with a spinner while credentials are checked
+        status_layout = QHBoxLayout()
+        self.spinner = Spinner()
+        status_layout.addWidget(self.spinner)
         self.status_label = QLabel("")
         self.status_label.setStyleSheet("color: #D32F2F;")
-        layout.addWidget(self.status_label)
+        status_layout.addWidget(self.status_label, 1)
+        layout.addLayout(status_layout)
         
         self.setLayout(layout)
     
+    def set_busy(self, busy):
+        for widget in (self.username, self.password, self.login_btn, self.forgot_btn):
+            widget.setEnabled(not busy)
+        if busy:
+            self.status_label.setText("")
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+    
     def attempt_login(self):
         username = self.username.text().strip()
         password = self.password.text().strip()
@@ -397,33 +1163,34 @@ class LoginDialog(QDialog):
             self.status_label.setText("Please enter both username and password")
             return
         
-        if auth_system.verify_user(username, password):
-            # Fetch user role from database
-            with sqlite3.connect(auth_system.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
-                result = cursor.fetchone()
-                role = result[0] if result else 'reception'
+        self.set_busy(True)
+        auth_service.submit("authenticate", username, password,
+                            on_result=lambda result: self.login_finished(username, result),
+                            on_error=self.login_failed)
+    
+    def login_failed(self, error):
+        self.set_busy(False)
+        self.status_label.setText(f"Login failed: {error}")
+    
+    def login_finished(self, username, result):
+        self.set_busy(False)
+        if result.success:
             # Store login session
             self.logged_in_user = {
                 'username': username,
-                'role': role,
+                'role': result.role,
                 'login_time': datetime.now()
             }
             if self.remember_me.isChecked():
                 self.save_session()
             self.accept()
+        elif result.locked_out:
+            self.status_label.setText(f"Account is locked out until {result.lockout_until:%H:%M}. "
+                                      f"Please try again later.")
+        elif result.remaining_attempts is not None and result.remaining_attempts <= 2:
+            self.status_label.setText(f"Invalid username or password "
+                                      f"({result.remaining_attempts} attempts left before lockout)")
         else:
-            # Check if account is locked out
-            with sqlite3.connect(auth_system.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT lockout_until FROM users WHERE username = ?", (username,))
-                result = cursor.fetchone()
-                if result and result[0]:
-                    lockout_time = datetime.fromisoformat(result[0])
-                    if lockout_time > datetime.now():
-                        self.status_label.setText("Account is locked out. Please try again later.")
-                        return
             self.status_label.setText("Invalid username or password")
     
     def save_session(self):
@@ -477,9 +1244,9 @@ class ForgotPasswordDialog(QDialog):
         step2_layout.addWidget(QLabel("Your answer:"))
         step2_layout.addWidget(self.answer_input)
         
-        verify_btn = QPushButton("Verify Answer")
-        verify_btn.clicked.connect(self.verify_answer)
-        step2_layout.addWidget(verify_btn)
+        self.verify_btn = QPushButton("Verify Answer")
+        self.verify_btn.clicked.connect(self.verify_answer)
+        step2_layout.addWidget(self.verify_btn)
         
         step2_widget.setLayout(step2_layout)
         
@@ -503,9 +1270,9 @@ class ForgotPasswordDialog(QDialog):
         self.password_strength.setStyleSheet("color: #D32F2F; font-size: 11px;")
         step3_layout.addWidget(self.password_strength)
         
-        reset_btn = QPushButton("Reset Password")
-        reset_btn.clicked.connect(self.reset_password)
-        step3_layout.addWidget(reset_btn)
+        self.reset_btn = QPushButton("Reset Password")
+        self.reset_btn.clicked.connect(self.reset_password)
+        step3_layout.addWidget(self.reset_btn)
         
         step3_widget.setLayout(step3_layout)
         
@@ -515,29 +1282,37 @@ class ForgotPasswordDialog(QDialog):
         self.stacked_widget.addWidget(step3_widget)
         
         layout.addWidget(self.stacked_widget)
+        
+        # Spinner shown while answers and passwords are hashed
+        self.spinner = Spinner()
+        layout.addWidget(self.spinner, alignment=Qt.AlignmentFlag.AlignCenter)
         self.setLayout(layout)
     
+    def set_busy(self, busy):
+        self.stacked_widget.setEnabled(not busy)
+        if busy:
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+    
+    def request_failed(self, error):
+        self.set_busy(False)
+        QMessageBox.warning(self, "Error", f"Request failed: {error}")
+    
     def verify_username(self):
         username = self.username_input.text().strip()
         if not username:
             QMessageBox.warning(self, "Error", "Please enter a username")
             return
         
-        # Query the database to check if user exists
-        with sqlite3.connect(auth_system.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT security_question FROM users WHERE username = ?", (username,))
-            result = cursor.fetchone()
-            
-            if not result:
-                QMessageBox.warning(self, "Error", "Username not found")
-                return
-            
-            # Get security question
-            question = result[0]
-            self.security_label.setText(f"Security Question: {question}")
-            self.current_username = username
-            self.stacked_widget.setCurrentIndex(1)
+        question = auth_system.get_security_question(username)
+        if question is None:
+            QMessageBox.warning(self, "Error", "Username not found")
+            return
+        
+        self.security_label.setText(f"Security Question: {question}")
+        self.current_username = username
+        self.stacked_widget.setCurrentIndex(1)
     
     def verify_answer(self):
         answer = self.answer_input.text().strip()
@@ -545,7 +1320,13 @@ class ForgotPasswordDialog(QDialog):
             QMessageBox.warning(self, "Error", "Please enter your answer")
             return
         
-        if auth_system.verify_security_answer(self.current_username, answer):
+        self.set_busy(True)
+        auth_service.submit("verify_security_answer", self.current_username, answer,
+                            on_result=self.answer_checked, on_error=self.request_failed)
+    
+    def answer_checked(self, correct):
+        self.set_busy(False)
+        if correct:
             self.stacked_widget.setCurrentIndex(2)
         else:
             QMessageBox.warning(self, "Error", "Incorrect answer")
@@ -564,7 +1345,13 @@ class ForgotPasswordDialog(QDialog):
             return
         
         # Reset password
-        success, message = auth_system.reset_password(self.current_username, new_pass)
+        self.set_busy(True)
+        auth_service.submit("reset_password", self.current_username, new_pass,
+                            on_result=self.password_reset, on_error=self.request_failed)
+    
+    def password_reset(self, result):
+        self.set_busy(False)
+        success, message = result
         if success:
             QMessageBox.information(self, "Success", "Password has been reset successfully")
             self.accept()
@@ -637,10 +1424,126 @@ class MainWindow(QMainWindow):
         self.ward_module.add_sample_room("102", "Private", 300, "Available")
         self.ward_module.add_sample_room("ICU201", "ICU", 500, "Available")
 
+class PatientTableModel(QAbstractTableModel):
+    """
+    Patient grid contents, fetched from the repository a page at a time as
+    the view scrolls, so only the rows scrolled to are ever loaded.
+    """
+    HEADERS = ["ID", "Name", "Age", "Gender", "Contact", "CNIC", "Diagnosis",
+               "Admit Date", "Room", "Doctor", "Actions"]
+    ACTIONS_COLUMN = 10
+    NAME_COLUMN = 1
+    PHOTO_SIZE = 24
+    PAGE_SIZE = 200
+    
+    def __init__(self, repository):
+        super().__init__()
+        self.repository = repository
+        self.rows = []
+        self.exhausted = False
+    
+    def show_rows(self, rows):
+        """Shows a fixed list of rows, e.g. search results, instead of paging."""
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.exhausted = True
+        self.endResetModel()
+    
+    def refresh(self):
+        """Goes back to paging through every patient, newest admissions first."""
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+    
+    def patient_id(self, row):
+        return self.rows[row][0]
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DecorationRole and index.column() == self.NAME_COLUMN:
+            photo_path = self.rows[index.row()][PATIENT_FIELDS.index("photo_path")]
+            if photo_path:
+                return photo_store.thumbnail(photo_path, self.PHOTO_SIZE, self.photo_loaded)
+            return None
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if index.column() == self.ACTIONS_COLUMN:
+            return "View Details"
+        value = self.rows[index.row()][index.column()]
+        return "" if value is None else str(value)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+    
+    def photo_loaded(self, pixmap):
+        # The view only repaints the visible part of the column
+        if self.rows:
+            self.dataChanged.emit(self.index(0, self.NAME_COLUMN),
+                                  self.index(len(self.rows) - 1, self.NAME_COLUMN),
+                                  [Qt.ItemDataRole.DecorationRole])
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+    
+    def fetchMore(self, parent):
+        if parent.isValid() or self.exhausted:
+            return
+        rows = self.repository.page(self.PAGE_SIZE, self.rows[-1] if self.rows else None)
+        self.exhausted = len(rows) < self.PAGE_SIZE
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+class ButtonDelegate(QStyledItemDelegate):
+    """
+    Paints a cell's text as a button and emits clicked(row), replacing a
+    QPushButton widget per row with a single painter.
+    """
+    clicked = pyqtSignal(int)
+    
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        hovered = option.state & QStyle.StateFlag.State_MouseOver
+        painter.setBrush(QColor("#1E6EB8" if hovered else "#2A82DA"))
+        painter.setPen(Qt.PenStyle.NoPen)
+        rect = QRectF(option.rect).adjusted(4, 3, -4, -3)
+        painter.drawRoundedRect(rect, 4, 4)
+        font = QFont(option.font)
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setPen(QColor("#FFFFFF"))
+        painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, index.data())
+        painter.restore()
+    
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.Type.MouseButtonRelease \
+                and option.rect.contains(event.position().toPoint()):
+            self.clicked.emit(index.row())
+            return True
+        return False
+
 class PatientManagement(QWidget):
     def __init__(self):
         super().__init__()
+        self.repository = patient_repository
+        self.searcher = PatientSearcher(self.repository)
+        self.searcher.results.connect(self.show_search_results)
+        self.searcher.failed.connect(self.search_failed)
         self.setup_ui()
+        self.patient_model.refresh()
     
     def setup_ui(self):
         layout = QVBoxLayout()
@@ -653,20 +1556,32 @@ class PatientManagement(QWidget):
         search_layout = QHBoxLayout()
         self.search_field = QLineEdit()
         self.search_field.setPlaceholderText("Search patients by name, ID, or CNIC...")
+        # Search as the user types, once typing pauses
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.search_patients)
+        self.search_field.textChanged.connect(self.search_timer.start)
+        self.search_field.returnPressed.connect(self.search_patients)
         search_btn = QPushButton("Search")
+        search_btn.clicked.connect(self.search_patients)
         search_layout.addWidget(self.search_field)
         search_layout.addWidget(search_btn)
         layout.addLayout(search_layout)
         
-        # Patient table
-        self.patient_table = QTableWidget()
-        self.patient_table.setColumnCount(11) # Increased column count for the "Actions" column
-        self.patient_table.setHorizontalHeaderLabels([
-            "ID", "Name", "Age", "Gender", "Contact", "CNIC", "Diagnosis", 
-            "Admit Date", "Room", "Doctor", "Actions"
-        ])
+        # Patient table, loaded page by page from the repository
+        self.patient_model = PatientTableModel(self.repository)
+        self.patient_table = QTableView()
+        self.patient_table.setModel(self.patient_model)
+        self.patient_table.setMouseTracking(True)  # hover color on the action buttons
+        self.actions_delegate = ButtonDelegate(self.patient_table)
+        self.actions_delegate.clicked.connect(
+            lambda row: self.view_patient_details(self.patient_model.patient_id(row)))
+        self.patient_table.setItemDelegateForColumn(PatientTableModel.ACTIONS_COLUMN, self.actions_delegate)
         self.patient_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.patient_table.verticalHeader().setVisible(False)
+        self.patient_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.patient_table.setIconSize(QSize(PatientTableModel.PHOTO_SIZE, PatientTableModel.PHOTO_SIZE))
         layout.addWidget(self.patient_table)
         
         # New patient button
@@ -679,30 +1594,71 @@ class PatientManagement(QWidget):
     def show_new_patient_form(self):
         self.form_dialog = PatientFormDialog()
         if self.form_dialog.exec() == QDialog.DialogCode.Accepted:
-            patient_data = self.form_dialog.get_data()
-            self.add_patient_to_table(patient_data)
+            patient = self.form_dialog.get_data()
+            if patient["photo_path"]:
+                try:
+                    patient["photo_path"] = photo_store.import_file(patient["photo_path"])
+                except OSError as e:
+                    QMessageBox.warning(self, "Error", f"Could not store the patient photo: {e}")
+                    return
+            if not self.repository.add(patient):
+                QMessageBox.warning(self, "Error", f"Patient ID {patient['patient_id']} already exists")
+                return
+            self.patient_model.refresh()
     
-    def add_patient_to_table(self, data):
-        row = self.patient_table.rowCount()
-        self.patient_table.insertRow(row)
-        
-        for col, value in enumerate(data):
-            item = QTableWidgetItem(str(value))
-            self.patient_table.setItem(row, col, item)
-        
-        # Add view details button
-        view_btn = QPushButton("View Details")
-        view_btn.clicked.connect(lambda: self.view_patient_details(row))
-        self.patient_table.setCellWidget(row, 10, view_btn)
+    def search_patients(self):
+        self.search_timer.stop()
+        text = self.search_field.text().strip()
+        if text:
+            self.searcher.search(text)
+        else:
+            self.searcher.cancel()
+            self.patient_model.refresh()
+    
+    def show_search_results(self, generation, rows):
+        # Results of a search the user has already typed past are dropped
+        if generation == self.searcher.generation:
+            self.patient_model.show_rows(rows)
+    
+    def search_failed(self, generation, error):
+        if generation == self.searcher.generation:
+            QMessageBox.warning(self, "Search Error", f"Search failed: {error}")
     
     def add_sample_patient(self, pid, name, age, gender, contact, cnic, diagnosis, admit_date, room, doctor, photo_path):
-        data = [pid, name, age, gender, contact, cnic, diagnosis, 
-                admit_date.toString("yyyy-MM-dd"), room, doctor]
-        self.add_patient_to_table(data)
+        # Sample data is only stored the first time
+        if self.repository.get(pid) is not None:
+            return
+        if photo_path and os.path.isfile(photo_path):
+            photo_path = photo_store.import_file(photo_path)
+        values = [pid, name, age, gender, contact, cnic, diagnosis,
+                  admit_date.toString("yyyy-MM-dd"), room, doctor, photo_path]
+        if self.repository.add(dict(zip(PATIENT_FIELDS, values))):
+            self.patient_model.refresh()
     
-    def view_patient_details(self, row):
-        patient_id = self.patient_table.item(row, 0).text()
-        QMessageBox.information(self, "Patient Details", f"Showing details for patient {patient_id}")
+    def view_patient_details(self, patient_id):
+        patient = self.repository.get(patient_id)
+        if patient is None:
+            QMessageBox.warning(self, "Patient Details", f"Patient {patient_id} no longer exists")
+            return
+        details = "\n".join([
+            f"Patient ID: {patient['patient_id']}",
+            f"Name: {patient['name']}",
+            f"Age: {patient['age']}",
+            f"Gender: {patient['gender']}",
+            f"Contact: {patient['contact']}",
+            f"CNIC: {patient['cnic']}",
+            f"Diagnosis: {patient['diagnosis'] or '-'}",
+            f"Admit Date: {patient['admit_date']}",
+            f"Room: {patient['room']}",
+            f"Doctor: {patient['doctor']}",
+        ])
+        box = QMessageBox(QMessageBox.Icon.Information, "Patient Details", details,
+                          QMessageBox.StandardButton.Ok, self)
+        if patient["photo_path"]:
+            pixmap = photo_store.thumbnail(patient["photo_path"], callback=box.setIconPixmap)
+            if pixmap is not None:
+                box.setIconPixmap(pixmap)
+        box.exec()
 
 class PatientFormDialog(QDialog):
     def __init__(self):
@@ -827,10 +1783,20 @@ class PatientFormDialog(QDialog):
         )
         
         if file_path:
+            if not QImageReader(file_path).canRead():
+                QMessageBox.warning(self, "Invalid Photo", "The selected file is not a readable image.")
+                return
+            # The file is copied into the photo store when the patient is saved
             self.photo_path = file_path
-            pixmap = QPixmap(file_path)
-            pixmap = pixmap.scaled(200, 200, Qt.AspectRatioMode.KeepAspectRatio, 
-                                  Qt.TransformationMode.SmoothTransformation)
+            self.photo_label.setText("Loading photo...")
+            pixmap = photo_store.thumbnail(
+                file_path, callback=lambda pixmap: self.show_photo(file_path, pixmap))
+            if pixmap is not None:
+                self.show_photo(file_path, pixmap)
+    
+    def show_photo(self, path, pixmap):
+        # Ignore a slow thumbnail of a photo that has since been replaced
+        if path == self.photo_path:
             self.photo_label.setPixmap(pixmap)
     
     def update_fee_requirements(self):
@@ -892,6 +1858,8 @@ class PatientFormDialog(QDialog):
             errors.append("Patient name is required")
         if not self.age.text():
             errors.append("Age is required")
+        elif not self.age.text().isdigit() or int(self.age.text()) > 150:
+            errors.append("Age must be a whole number between 0 and 150")
         if not self.contact.text():
             errors.append("Contact information is required")
         if not self.cnic.text():
@@ -912,22 +1880,85 @@ class PatientFormDialog(QDialog):
         self.accept()
     
     def get_data(self):
-        return [
-            self.pid.text(),
-            self.name.text(),
-            self.age.text(),
-            self.gender.currentText(),
-            self.contact.text(),
-            self.cnic.text(),
-            self.diagnosis.toPlainText(),
-            self.admit_date.date(),
-            self.room.currentText(),
-            self.doctor.currentText()
-        ]
+        """Returns the patient as a dict keyed by PATIENT_FIELDS."""
+        return {
+            "patient_id": self.pid.text().strip(),
+            "name": self.name.text().strip(),
+            "age": int(self.age.text()),
+            "gender": self.gender.currentText(),
+            "contact": self.contact.text().strip(),
+            "cnic": self.cnic.text(),
+            "diagnosis": self.diagnosis.toPlainText(),
+            "admit_date": self.admit_date.date().toString("yyyy-MM-dd"),
+            "room": self.room.currentText(),
+            "doctor": self.doctor.currentText(),
+            "photo_path": self.photo_path or None,
+        }
+
+class ChargeTableModel(QAbstractTableModel):
+    """An admission's itemized charges, fetched a page at a time as the view scrolls."""
+    HEADERS = ["Date", "Service", "Quantity", "Unit Price", "Amount"]
+    PAGE_SIZE = 200
+    
+    def __init__(self, ledger):
+        super().__init__()
+        self.ledger = ledger
+        self.admission = None
+        self.rows = []
+        self.exhausted = True
+    
+    def set_admission(self, admission):
+        """Shows the charges of (patient_id, admit_date), or nothing for None."""
+        self.admission = admission
+        self.refresh()
+    
+    def refresh(self):
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = self.admission is None
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+    
+    def charge(self, row):
+        return self.rows[row]
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        charge = self.rows[index.row()]
+        return [charge.charge_date, charge.service, str(charge.quantity),
+                f"${charge.unit_price:,.2f}", f"${charge.amount:,.2f}"][index.column()]
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+    
+    def fetchMore(self, parent):
+        if parent.isValid() or self.exhausted:
+            return
+        rows = self.ledger.charges(*self.admission, self.PAGE_SIZE, self.rows[-1] if self.rows else None)
+        self.exhausted = len(rows) < self.PAGE_SIZE
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
 
 class BillingManagement(QWidget):
     def __init__(self):
         super().__init__()
+        self.repository = patient_repository
+        self.ledger = billing_ledger
+        self.admission = None  # (patient_id, admit_date) of the bill on screen
         self.setup_ui()
     
     def setup_ui(self):
@@ -937,11 +1968,15 @@ class BillingManagement(QWidget):
         header = GradientHeader("Billing & Cost Management")
         layout.addWidget(header)
         
-        # Patient selection
+        # Patient selection: recent admissions, or type any patient ID
         patient_layout = QHBoxLayout()
         patient_layout.addWidget(QLabel("Select Patient:"))
         self.patient_select = QComboBox()
-        self.patient_select.addItems(["P001 - John Doe", "P002 - Jane Smith"])
+        self.patient_select.setEditable(True)
+        self.patient_select.setInsertPolicy(QComboBox.InsertPolicy.NoInsert)
+        self.patient_select.lineEdit().setPlaceholderText("Patient ID")
+        self.patient_select.activated.connect(self.load_bill)
+        self.patient_select.lineEdit().returnPressed.connect(self.load_bill)
         patient_layout.addWidget(self.patient_select)
         layout.addLayout(patient_layout)
         
@@ -952,16 +1987,24 @@ class BillingManagement(QWidget):
         charges_tab = QWidget()
         charges_layout = QVBoxLayout()
         
-        # Charges table
-        self.charges_table = QTableWidget()
-        self.charges_table.setColumnCount(5)
-        self.charges_table.setHorizontalHeaderLabels(["Date", "Service", "Quantity", "Unit Price", "Amount"])
+        # Charges table, loaded page by page from the ledger
+        self.charges_model = ChargeTableModel(self.ledger)
+        self.charges_table = QTableView()
+        self.charges_table.setModel(self.charges_model)
         self.charges_table.verticalHeader().setVisible(False)
+        self.charges_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.charges_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         charges_layout.addWidget(self.charges_table)
         
-        # Add charge button
+        # Charge buttons
+        charge_btn_layout = QHBoxLayout()
         add_charge_btn = QPushButton("Add Charge")
-        charges_layout.addWidget(add_charge_btn)
+        add_charge_btn.clicked.connect(self.add_charge)
+        remove_charge_btn = QPushButton("Remove Charge")
+        remove_charge_btn.clicked.connect(self.remove_charge)
+        charge_btn_layout.addWidget(add_charge_btn)
+        charge_btn_layout.addWidget(remove_charge_btn)
+        charges_layout.addLayout(charge_btn_layout)
         charges_tab.setLayout(charges_layout)
         
         # Summary tab
@@ -973,6 +2016,7 @@ class BillingManagement(QWidget):
         self.total = QLabel("$0.00")
         self.payment_status = QComboBox()
         self.payment_status.addItems(["Unpaid", "Partially Paid", "Paid"])
+        self.payment_status.activated.connect(self.save_payment_details)
         self.insurance = QTextEdit()
         
         summary_layout.addRow("Subtotal:", self.subtotal)
@@ -983,6 +2027,7 @@ class BillingManagement(QWidget):
         
         # Generate invoice button
         invoice_btn = QPushButton("Generate Invoice")
+        invoice_btn.clicked.connect(self.generate_invoice)
         summary_layout.addRow(invoice_btn)
         
         summary_tab.setLayout(summary_layout)
@@ -992,6 +2037,212 @@ class BillingManagement(QWidget):
         
         layout.addWidget(billing_tabs)
         self.setLayout(layout)
+    
+    def showEvent(self, event):
+        # Patients may have been registered since the tab was last shown
+        self.refresh_patients()
+        super().showEvent(event)
+    
+    def refresh_patients(self):
+        """Lists the most recent admissions; older patients can be typed by ID."""
+        current = self.patient_select.currentText()
+        self.patient_select.clear()
+        for row in self.repository.page(PatientTableModel.PAGE_SIZE):
+            self.patient_select.addItem(f"{row[0]} - {row[1]}", row[0])
+        self.patient_select.setCurrentText(current)
+    
+    def load_bill(self):
+        self.save_payment_details()
+        index = self.patient_select.currentIndex()
+        text = self.patient_select.currentText().strip()
+        if index >= 0 and self.patient_select.itemText(index) == text:
+            patient_id = self.patient_select.itemData(index)
+        else:
+            patient_id = text.split(" - ")[0].strip()
+        try:
+            patient = self.repository.get(patient_id) if patient_id else None
+            if patient is None:
+                self.admission = None
+                if patient_id:
+                    QMessageBox.warning(self, "Billing", f"No patient with ID {patient_id}")
+            else:
+                # A patient without an admit date is billed under '', as in
+                # PatientRepository.page
+                self.admission = (patient["patient_id"], patient["admit_date"] or "")
+            # The totals are one row of `bills`; charges are only fetched as shown
+            bill = self.ledger.bill(*self.admission) if self.admission else None
+            self.charges_model.set_admission(self.admission)
+        except sqlite3.Error as e:
+            self.admission = None
+            self.charges_model.set_admission(None)
+            QMessageBox.warning(self, "Billing Error", f"Could not load the bill: {e}")
+            bill = None
+        self.show_totals(bill)
+        self.payment_status.setCurrentText(bill.payment_status if bill else "Unpaid")
+        self.insurance.setPlainText(bill.insurance if bill else "")
+    
+    def show_totals(self, bill):
+        self.subtotal.setText(f"${bill.subtotal:,.2f}" if bill else "$0.00")
+        self.tax.setText(f"${bill.tax:,.2f}" if bill else "$0.00")
+        self.total.setText(f"${bill.total:,.2f}" if bill else "$0.00")
+    
+    def add_charge(self):
+        if self.admission is None:
+            QMessageBox.warning(self, "Billing", "Select a patient first")
+            return
+        dialog = ChargeDialog(self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        try:
+            _, bill = self.ledger.add_charge(*self.admission, *dialog.get_data())
+            self.show_totals(bill)
+            self.charges_model.refresh()
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "Billing Error", f"Could not add the charge: {e}")
+    
+    def remove_charge(self):
+        row = self.charges_table.currentIndex().row()
+        if self.admission is None or row < 0:
+            return
+        try:
+            self.ledger.remove_charge(self.charges_model.charge(row).charge_id)
+            self.show_totals(self.ledger.bill(*self.admission))
+            self.charges_model.refresh()
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "Billing Error", f"Could not remove the charge: {e}")
+    
+    def save_payment_details(self):
+        """Stores the payment status and insurance; False if that failed."""
+        if self.admission is None:
+            return True
+        try:
+            self.ledger.set_payment(*self.admission, self.payment_status.currentText(),
+                                    self.insurance.toPlainText())
+            return True
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "Billing Error", f"Could not save the payment details: {e}")
+            return False
+    
+    def generate_invoice(self):
+        if self.admission is None:
+            QMessageBox.warning(self, "Billing", "Select a patient first")
+            return
+        if not self.save_payment_details():
+            return
+        patient_id, admit_date = self.admission
+        try:
+            patient = self.repository.get(patient_id)
+            if patient is None:
+                QMessageBox.warning(self, "Billing", f"Patient {patient_id} no longer exists")
+                return
+            bill = self.ledger.bill(*self.admission)
+            charges = self.ledger.charges(*self.admission)
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "Billing Error", f"Could not read the bill: {e}")
+            return
+        lines = [
+            "HOSPITAL INVOICE",
+            f"Patient: {patient['patient_id']} - {patient['name']}",
+            f"Admitted: {admit_date or '-'}",
+            "",
+        ]
+        for charge in charges:
+            lines.append(f"{charge.charge_date}  {charge.service:<30} {charge.quantity:>4} x "
+                         f"{charge.unit_price:>10,.2f} = {charge.amount:>12,.2f}")
+        lines += [
+            "",
+            f"Subtotal:  ${bill.subtotal:,.2f}",
+            f"Tax (10%): ${bill.tax:,.2f}",
+            f"Total:     ${bill.total:,.2f}",
+            f"Payment Status: {bill.payment_status}",
+        ]
+        if bill.insurance:
+            lines.append(f"Insurance: {bill.insurance}")
+        
+        default_name = "_".join(filter(None, ["invoice", patient_id, admit_date])) + ".txt"
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Invoice", default_name, "Text Files (*.txt)")
+        if not file_path:
+            return
+        try:
+            with open(file_path, "w", encoding="utf-8") as file:
+                file.write("\n".join(lines) + "\n")
+        except OSError as e:
+            QMessageBox.warning(self, "Invoice", f"Could not save the invoice: {e}")
+            return
+        QMessageBox.information(self, "Invoice", f"Invoice saved to {file_path}")
+
+class ChargeDialog(QDialog):
+    SERVICES = ["Room Charges", "Doctor Fee", "Consultation", "Lab Test",
+                "Medicine", "Surgery", "Radiology"]
+    MAX_QUANTITY = 10000
+    MAX_UNIT_PRICE = Decimal("1000000000")
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Add Charge")
+        self.setFixedSize(400, 250)
+        
+        layout = QVBoxLayout()
+        form_layout = QFormLayout()
+        
+        self.charge_date = QDateEdit()
+        self.charge_date.setDate(QDate.currentDate())
+        self.service = QComboBox()
+        self.service.setEditable(True)
+        self.service.addItems(self.SERVICES)
+        self.quantity = QLineEdit("1")
+        self.unit_price = QLineEdit()
+        self.unit_price.setPlaceholderText("0.00")
+        
+        form_layout.addRow("Date:", self.charge_date)
+        form_layout.addRow("Service*:", self.service)
+        form_layout.addRow("Quantity*:", self.quantity)
+        form_layout.addRow("Unit Price*:", self.unit_price)
+        layout.addLayout(form_layout)
+        
+        # Buttons
+        btn_layout = QHBoxLayout()
+        save_btn = QPushButton("Add Charge")
+        save_btn.clicked.connect(self.validate_form)
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.clicked.connect(self.reject)
+        
+        btn_layout.addStretch()
+        btn_layout.addWidget(cancel_btn)
+        btn_layout.addWidget(save_btn)
+        
+        layout.addLayout(btn_layout)
+        self.setLayout(layout)
+    
+    def parse_price(self):
+        """The unit price as a Decimal, or None if it is not a valid amount."""
+        try:
+            price = Decimal(self.unit_price.text().strip().lstrip("$").replace(",", ""))
+        except InvalidOperation:
+            return None
+        if not price.is_finite() or not 0 < price <= self.MAX_UNIT_PRICE or price != price.quantize(CENT):
+            return None
+        return price
+    
+    def validate_form(self):
+        errors = []
+        if not self.service.currentText().strip():
+            errors.append("Service is required")
+        if not self.quantity.text().isdigit() or not 1 <= int(self.quantity.text()) <= self.MAX_QUANTITY:
+            errors.append(f"Quantity must be a whole number between 1 and {self.MAX_QUANTITY}")
+        if self.parse_price() is None:
+            errors.append("Unit price must be a positive amount with at most two decimals")
+        
+        if errors:
+            QMessageBox.warning(self, "Validation Error", "\n".join(errors))
+            return
+        
+        self.accept()
+    
+    def get_data(self):
+        """Returns (charge_date, service, quantity, unit_price) for BillingLedger.add_charge."""
+        return (self.charge_date.date().toString("yyyy-MM-dd"), self.service.currentText().strip(),
+                int(self.quantity.text()), self.parse_price())
 
 class DoctorManagement(QWidget):
     def __init__(self):
@@ -1189,6 +2440,11 @@ if __name__ == "__main__":
     # Apply global stylesheet
     app.setStyleSheet(GLOBAL_STYLESHEET)
     
+    # Retention job: drop password history older than the reuse window
+    pruned = auth_system.prune_password_history()
+    if pruned:
+        print(f"Pruned {pruned} old password history entries.")
+    
     # Conditionally register admin user ONLY if they don't exist
     # auth_system is already initialized globally, no need to reinitialize
     if not auth_system.user_exists("admin"):
@@ -1208,9 +2464,17 @@ if __name__ == "__main__":
         print("Admin user already exists. Skipping default registration.")
     
     # Show login dialog
+    app.aboutToQuit.connect(auth_service.shutdown)
+    app.aboutToQuit.connect(auth_system.close)
+    app.aboutToQuit.connect(photo_store.close)
+    app.aboutToQuit.connect(database.close_all)
     login = LoginDialog()
     if login.exec() == QDialog.DialogCode.Accepted:
         # Use the actual logged-in username from the LoginDialog
         main_window = MainWindow(login.logged_in_user['username']) 
         main_window.show()
-        sys.exit(app.exec())
\ No newline at end of file
+        sys.exit(app.exec())
+    auth_service.shutdown()
+    auth_system.close()
+    photo_store.close()
+    database.close_all()
\ No newline at end of file